@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the personal data module
+
+The redaction suite redacts synthetic records shaped like user_data.csv
+with each strategy while varying the message length, the number of
+redacted PII fields and the ratio of records that actually contain PII,
+and reports ns/record and MB/s. The hashing suite compares hashing one
+password at a time with the threaded batch API of encrypt_password.
+Results can be saved as JSON and compared against a previous run.
+
+Usage:
+    ./benchmark.py [--suite redaction|hashing] [--json results.json]
+                   [--compare baseline.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import re
+import string
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import filtered_logger
+from encrypt_password import hash_password, hash_password_many
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+METRICS = ("ns_per_record", "mb_per_s", "per_s")
+
+
+class _NullStream:
+    """Stream discarding everything written to it"""
+
+    def write(self, data: str) -> int:
+        """Discards data"""
+        return len(data)
+
+    def flush(self):
+        """Nothing to flush"""
+
+
+def _text(rng: random.Random, length: int) -> str:
+    """Returns random printable text without separators"""
+    alphabet = string.ascii_letters + string.digits + " .-@()/"
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def make_records(count: int, length: int, hit_ratio: float,
+                 distinct: int = None, seed: int = 0) -> List[Dict]:
+    """
+    Generates synthetic user rows.
+
+    Arguments:
+    count -- Number of records.
+    length -- Approximate length of each rendered message in characters;
+      the user_agent column is padded to reach it.
+    hit_ratio -- Fraction of records carrying PII columns. The others only
+      contain the non-PII columns.
+    distinct -- Number of distinct records to draw from (default is
+      count), to simulate repeated log lines.
+    seed -- Seed of the random generator.
+
+    Returns:
+    A list of dictionaries keyed by column name.
+    """
+    rng = random.Random(seed)
+    pool = []
+    for i in range(distinct or count):
+        row = {
+            "name": _text(rng, 12),
+            "email": "{}@example.com".format(_text(rng, 8).replace(" ", "")),
+            "phone": "({}) {}-{}".format(rng.randint(100, 999),
+                                         rng.randint(100, 999),
+                                         rng.randint(1000, 9999)),
+            "ssn": "{}-{}-{}".format(rng.randint(100, 999),
+                                     rng.randint(10, 99),
+                                     rng.randint(1000, 9999)),
+            "password": _text(rng, 10),
+            "ip": ":".join("{:x}".format(rng.randint(0, 65535))
+                           for _ in range(8)),
+            "last_login": "2019-11-14 06:14:24",
+            "user_agent": "",
+        }
+        if rng.random() >= hit_ratio:
+            for field in PII_FIELDS:
+                del row[field]
+        used = len(render(row))
+        row["user_agent"] = _text(rng, max(length - used, 0))
+        pool.append(row)
+    return [pool[i % len(pool)] for i in range(count)]
+
+
+def render(row: Dict) -> str:
+    """Renders a row the way it is logged as a string"""
+    sep = RedactingFormatter.SEPARATOR
+    return "".join("{}={}{}".format(k, v, sep) for k, v in row.items())
+
+
+def legacy_filter_datum(fields: List[str], redaction: str, message: str,
+                        separator: str) -> str:
+    """The original one-pass-per-field filter_datum, as a baseline"""
+    for f in fields:
+        message = re.sub(f"{f}=.*?{separator}",
+                         f"{f}={redaction}{separator}", message)
+    return message
+
+
+def _record(msg) -> logging.LogRecord:
+    """Builds a log record the way logging.Logger does"""
+    return logging.LogRecord("user_data", logging.INFO, None, None, msg,
+                             None, None)
+
+
+def _bench_filter(func: Callable) -> Callable:
+    """Wraps a filter_datum-like function into a strategy"""
+    def run(rows: List[Dict], messages: List[str], fields: List[str]):
+        redaction = RedactingFormatter.REDACTION
+        sep = RedactingFormatter.SEPARATOR
+        for message in messages:
+            func(fields, redaction, message, sep)
+    return run
+
+
+def _bench_formatter(cache_size: int, structured: bool = False) -> Callable:
+    """Returns a strategy calling RedactingFormatter.format directly"""
+    def run(rows: List[Dict], messages: List[str], fields: List[str]):
+        formatter = RedactingFormatter(fields, cache_size=cache_size)
+        for msg in (rows if structured else messages):
+            formatter.format(_record(msg))
+    return run
+
+
+def _bench_logger(queued: bool) -> Callable:
+    """Returns a strategy logging through get_logger into a null stream"""
+    def run(rows: List[Dict], messages: List[str], fields: List[str]):
+        logger = filtered_logger.get_logger(queued=queued,
+                                            maxsize=len(messages) + 1)
+        handler = logger.handlers[-1]
+        targets = handler.listener.handlers if queued else (handler,)
+        for target in targets:
+            target.setStream(_NullStream())
+            target.formatter = RedactingFormatter(fields)
+        try:
+            for message in messages:
+                logger.info(message)
+            handler.flush()
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+    return run
+
+
+STRATEGIES = {
+    "legacy_filter_datum": _bench_filter(legacy_filter_datum),
+    "filter_datum": _bench_filter(filter_datum),
+    "formatter": _bench_formatter(cache_size=0),
+    "formatter_cached": _bench_formatter(
+        cache_size=RedactingFormatter.CACHE_SIZE),
+    "formatter_structured": _bench_formatter(cache_size=0, structured=True),
+    "get_logger": _bench_logger(queued=False),
+    "get_logger_queued": _bench_logger(queued=True),
+}
+
+
+def run_redaction_suite(args: argparse.Namespace) -> List[Dict]:
+    """
+    Runs every selected strategy on every point of the parameter grid.
+
+    Returns:
+    One result dictionary per (strategy, length, fields, hit ratio).
+    """
+    results = []
+    for length in args.lengths:
+        for hit_ratio in args.hit_ratios:
+            rows = make_records(args.records, length, hit_ratio,
+                                args.distinct, args.seed)
+            messages = [render(row) for row in rows]
+            size = sum(len(m.encode()) for m in messages)
+            for n_fields in args.fields:
+                fields = list(PII_FIELDS[:n_fields])
+                for name in args.strategies:
+                    elapsed = _best_of(args.repeat, STRATEGIES[name],
+                                       rows, messages, fields)
+                    results.append({
+                        "suite": "redaction",
+                        "strategy": name,
+                        "length": length,
+                        "fields": n_fields,
+                        "hit_ratio": hit_ratio,
+                        "records": len(messages),
+                        "ns_per_record": elapsed * 1e9 / len(messages),
+                        "mb_per_s": size / elapsed / 1e6,
+                    })
+                    _print_result(results[-1])
+    return results
+
+
+def run_hashing_suite(args: argparse.Namespace) -> List[Dict]:
+    """
+    Hashes the same passwords one at a time with hash_password, then in
+    batches with hash_password_many for every requested worker count.
+
+    Returns:
+    One result dictionary per strategy and worker count.
+    """
+    rng = random.Random(args.seed)
+    passwords = [_text(rng, 12) for _ in range(args.passwords)]
+    cases = [("hash_password", 1,
+              lambda: [hash_password(p) for p in passwords])]
+    for workers in args.workers:
+        cases.append(("hash_password_many", workers,
+                      lambda w=workers: hash_password_many(passwords, w)))
+    results = []
+    for name, workers, func in cases:
+        elapsed = _best_of(args.repeat, func)
+        results.append({
+            "suite": "hashing",
+            "strategy": name,
+            "workers": workers,
+            "records": len(passwords),
+            "ns_per_record": elapsed * 1e9 / len(passwords),
+            "per_s": len(passwords) / elapsed,
+        })
+        _print_result(results[-1])
+    return results
+
+
+SUITES = {
+    "redaction": run_redaction_suite,
+    "hashing": run_hashing_suite,
+}
+
+
+def _best_of(repeat: int, func: Callable, *args) -> float:
+    """Returns the fastest wall time of repeat calls of func"""
+    best = float("inf")
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _key(result: Dict) -> str:
+    """Identifies a benchmark case across runs"""
+    params = sorted((k, v) for k, v in result.items() if k not in METRICS)
+    return json.dumps(params)
+
+
+def _print_result(result: Dict, baseline: Dict = None):
+    """Prints one result line, with the change against baseline if any"""
+    params = " ".join("{}={}".format(k, v) for k, v in result.items()
+                      if k != "suite" and k not in METRICS)
+    line = "{:<72} {:>12.0f} ns/record".format(
+        params, result["ns_per_record"])
+    if "mb_per_s" in result:
+        line += " {:>9.2f} MB/s".format(result["mb_per_s"])
+    if "per_s" in result:
+        line += " {:>9.1f} /s".format(result["per_s"])
+    if baseline:
+        change = result["ns_per_record"] / baseline["ns_per_record"] - 1
+        line += " {:+7.1%}".format(change)
+    print(line, flush=True)
+
+
+def compare(results: List[Dict], path: str):
+    """Prints every result next to the matching case of a previous run"""
+    with open(path) as f:
+        previous = {_key(r): r for r in json.load(f)["results"]}
+    print("\nCompared to {} (negative is faster):".format(path))
+    for result in results:
+        _print_result(result, previous.get(_key(result)))
+
+
+def _list(cast: Callable) -> Callable:
+    """Returns an argparse type parsing a comma separated list"""
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the personal data module.")
+    parser.add_argument("--suite", choices=list(SUITES), default="redaction")
+    parser.add_argument("--strategies", type=_list(str),
+                        default=list(STRATEGIES),
+                        help="comma separated strategies to run")
+    parser.add_argument("--lengths", type=_list(int),
+                        default=[128, 512, 2048],
+                        help="comma separated message lengths")
+    parser.add_argument("--fields", type=_list(int), default=[1, 3, 5],
+                        help="comma separated numbers of PII fields")
+    parser.add_argument("--hit-ratios", type=_list(float),
+                        default=[0.0, 0.5, 1.0],
+                        help="comma separated ratios of records with PII")
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="number of distinct records (default: all)")
+    parser.add_argument("--passwords", type=int, default=16,
+                        help="number of passwords hashed (hashing suite)")
+    parser.add_argument("--workers", type=_list(int), default=[1, 2, 4, 8],
+                        help="comma separated thread counts (hashing suite)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="previous --json file")
+    args = parser.parse_args(argv)
+    unknown = set(args.strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error("unknown strategies: {}".format(", ".join(unknown)))
+    return args
+
+
+def main():
+    """
+    Command line entry point.
+    """
+    args = parse_args()
+    results = SUITES[args.suite](args)
+    if args.json:
+        report = {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "arguments": vars(args),
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
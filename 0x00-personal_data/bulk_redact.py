@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Bulk redaction of large log files
+
+The input file is memory-mapped and split into line-aligned chunks that
+are redacted across a process pool with the same rules as filter_datum.
+Chunks are written back in their original order.
+
+Usage:
+    ./bulk_redact.py input.log output.log [--workers N] [--chunk-size B]
+"""
+import argparse
+import mmap
+import os
+import sys
+from multiprocessing import Pool
+from typing import BinaryIO, Iterator, List, Tuple
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+_worker_state = {}
+
+
+def chunk_bounds(buf, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Splits a buffer into line-aligned (start, end) ranges.
+
+    Arguments:
+    buf -- A bytes-like object supporting find (e.g. an mmap).
+    chunk_size -- The approximate size of each chunk in bytes.
+
+    Returns:
+    An iterator of (start, end) offsets covering the whole buffer; every
+    range but the last ends right after a newline.
+    """
+    size = len(buf)
+    chunk_size = max(chunk_size, 1)
+    start = 0
+    while start < size:
+        end = buf.find(b"\n", min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def _init_worker(src: str, fields: List[str], redaction: str,
+                 separator: str):
+    """
+    Maps the input file once per worker process.
+    """
+    f = open(src, "rb")
+    _worker_state["file"] = f
+    _worker_state["map"] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker_state["rule"] = (fields, redaction, separator)
+
+
+def _redact_chunk(bounds: Tuple[int, int]) -> bytes:
+    """
+    Redacts one chunk of the mapped input file.
+    """
+    start, end = bounds
+    fields, redaction, separator = _worker_state["rule"]
+    text = _worker_state["map"][start:end].decode("utf-8", "surrogateescape")
+    text = filter_datum(fields, redaction, text, separator)
+    return text.encode("utf-8", "surrogateescape")
+
+
+def redact_file(src: str, dst: BinaryIO, fields: List[str],
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                workers: int = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Redacts a whole file into a binary stream.
+
+    Arguments:
+    src -- Path of the file to redact.
+    dst -- Binary stream receiving the redacted content.
+    fields -- List of field names that should be obfuscated.
+    redaction -- The value that should replace the obfuscated fields.
+    separator -- The character that separates fields in each line.
+    workers -- Number of worker processes (defaults to the CPU count).
+    chunk_size -- Approximate number of bytes handed to a worker at once.
+
+    Returns:
+    The number of bytes read from src.
+    """
+    size = os.path.getsize(src)
+    if size == 0:
+        return 0
+    with open(src, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        bounds = list(chunk_bounds(buf, chunk_size))
+    args = (src, list(fields), redaction, separator)
+    with Pool(workers, initializer=_init_worker, initargs=args) as pool:
+        for chunk in pool.imap(_redact_chunk, bounds):
+            dst.write(chunk)
+    return size
+
+
+def main():
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields from a log file in parallel.")
+    parser.add_argument("input", help="log file to redact")
+    parser.add_argument("output", help="destination file, '-' for stdout")
+    parser.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("--redaction", default=RedactingFormatter.REDACTION)
+    parser.add_argument("--separator", default=RedactingFormatter.SEPARATOR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="approximate chunk size in bytes")
+    args = parser.parse_args()
+
+    fields = [f for f in args.fields.split(",") if f]
+    if args.output == "-":
+        redact_file(args.input, sys.stdout.buffer, fields, args.redaction,
+                    args.separator, args.workers, args.chunk_size)
+        return
+    with open(args.output, "wb") as out:
+        redact_file(args.input, out, fields, args.redaction,
+                    args.separator, args.workers, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Module for pooling database connections
+"""
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List
+
+
+class PoolError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+def default_health_check(conn: Any) -> bool:
+    """
+    Checks that a connection is still usable.
+
+    MySQL connections are pinged through is_connected(); any other DB-API
+    connection must be able to run "SELECT 1".
+
+    Arguments:
+    conn -- The raw connection to check.
+
+    Returns:
+    True if the connection can be handed out again, False otherwise.
+    """
+    if hasattr(conn, "is_connected"):
+        return conn.is_connected()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class PooledConnection:
+    """Connection checked out of a ConnectionPool
+
+    Attribute access is delegated to the underlying connection; close()
+    hands the connection back to its pool instead of closing it. A
+    PooledConnection garbage collected without being closed gives its
+    connection back too, so a leak cannot use up the pool.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn: Any):
+        self._pool = pool
+        self._conn = conn
+        # holds no reference to self, so it runs when self is collected
+        self._finalizer = weakref.finalize(self, pool._release, conn)
+        self._finalizer.atexit = False
+
+    def __getattr__(self, name: str) -> Any:
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise PoolError("Connection already returned to the pool")
+        return getattr(conn, name)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Returns the connection to the pool"""
+        if self._conn is not None:
+            self._conn = None
+            self._finalizer()
+
+
+class ConnectionPool:
+    """Fixed-size pool of database connections
+
+    Connections are created lazily by factory, up to size of them, and
+    are checked with health_check every time they leave the pool; a
+    connection failing the check is closed and replaced.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 5,
+                 name: str = "pool",
+                 health_check: Callable[[Any], bool] = default_health_check):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.factory = factory
+        self.size = size
+        self.name = name
+        self.health_check = health_check
+        self._idle: List[Any] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {"created": 0, "reused": 0, "waits": 0,
+                       "health_failures": 0}
+
+    def get_connection(self, timeout: float = None) -> PooledConnection:
+        """
+        Checks a healthy connection out of the pool.
+
+        Arguments:
+        timeout -- Seconds to wait for a connection when all of them are
+          in use (default is to wait forever).
+
+        Returns:
+        A PooledConnection wrapping the raw connection.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._idle and self._in_use >= self.size:
+                self._stats["waits"] += 1
+            while not self._idle and self._in_use >= self.size:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(
+                            "Pool '{}' exhausted".format(self.name))
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self.health_check(conn):
+                self._count("health_failures")
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self.factory()
+                self._count("created")
+            else:
+                self._count("reused")
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, conn)
+
+    def _count(self, key: str):
+        """Increments one of the statistics counters"""
+        with self._cond:
+            self._stats[key] += 1
+
+    def _release(self, conn: Any):
+        """
+        Puts a checked-out connection back in the idle list, after rolling
+        back whatever transaction it left open so that its changes and
+        locks do not pass to the next borrower; a connection failing to
+        roll back is closed instead.
+        """
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            conn = None
+        with self._cond:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @staticmethod
+    def _discard(conn: Any):
+        """Closes a connection, ignoring errors from dead ones"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the pool statistics: its name and size, the number of
+        idle and in-use connections, and counters of created and reused
+        connections, waits for a free slot and failed health checks.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(name=self.name, size=self.size,
+                         idle=len(self._idle), in_use=self._in_use)
+        return stats
+
+    def close_all(self):
+        """Closes every idle connection"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
@@ -3,6 +3,83 @@
 Encrypting passwords
 """
 import bcrypt
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+_rounds = None
+
+
+class BatchResult(NamedTuple):
+    """
+    Outcome of one item of a batch operation: value holds the result,
+    or error holds the exception raised for that item.
+    """
+    value: Any
+    error: Optional[Exception]
+
+
+def get_rounds() -> int:
+    """
+    Returns the bcrypt cost factor used for new hashes.
+
+    This is the value given to set_rounds, if any, otherwise the
+    BCRYPT_ROUNDS environment variable (default is 12).
+    """
+    if _rounds is not None:
+        return _rounds
+    return int(environ.get("BCRYPT_ROUNDS", DEFAULT_ROUNDS))
+
+
+def set_rounds(rounds: int = None):
+    """
+    Sets the bcrypt cost factor used for new hashes, typically to the
+    result of calibrate_rounds. None restores the default.
+    """
+    global _rounds
+    if rounds is not None and not MIN_ROUNDS <= rounds <= MAX_ROUNDS:
+        raise ValueError("rounds must be between {} and {}".format(
+            MIN_ROUNDS, MAX_ROUNDS))
+    _rounds = rounds
+
+
+def calibrate_rounds(target_ms: float = 250.0, min_rounds: int = 10,
+                     max_rounds: int = 16) -> int:
+    """
+    Picks the highest bcrypt cost whose verification fits in target_ms
+    on this host.
+
+    Verification time doubles with every round, so it is measured at
+    min_rounds and extrapolated, then the candidate is measured to
+    confirm it and lowered while it exceeds the target.
+
+    Arguments:
+    target_ms -- The verification latency budget in milliseconds.
+    min_rounds -- The lowest cost ever returned, even on slow hosts.
+    max_rounds -- The highest cost ever returned.
+
+    Returns:
+    The chosen cost factor.
+    """
+    def verify_ms(rounds: int) -> float:
+        hashed = bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+        start = time.perf_counter()
+        bcrypt.checkpw(b"calibration", hashed)
+        return (time.perf_counter() - start) * 1000
+
+    base = verify_ms(min_rounds)
+    rounds = min_rounds
+    while rounds < max_rounds and base * 2 ** (rounds + 1 - min_rounds) \
+            <= target_ms:
+        rounds += 1
+    while rounds > min_rounds and verify_ms(rounds) > target_ms:
+        rounds -= 1
+    return rounds
 
 
 def hash_password(password: str) -> bytes:
@@ -16,7 +93,7 @@ def hash_password(password: str) -> bytes:
     A byte string representing the hashed password.
     """
     encoded = password.encode()
-    hashed = bcrypt.hashpw(encoded, bcrypt.gensalt())
+    hashed = bcrypt.hashpw(encoded, bcrypt.gensalt(get_rounds()))
 
     return hashed
 
@@ -33,3 +110,76 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     True if the password matches the hashed password, False otherwise.
     """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Checks if a hashed password was made with another cost than the
+    current one, so that callers can rehash it after a successful
+    is_valid.
+
+    Arguments:
+    hashed_password -- The hashed password.
+
+    Returns:
+    True if the hash should be replaced, False otherwise.
+    """
+    try:
+        cost = int(hashed_password.split(b"$")[2])
+    except (IndexError, ValueError):
+        return True
+    return cost != get_rounds()
+
+
+def _run_batch(func: Callable, items: Sequence[tuple],
+               workers: int = None) -> List[BatchResult]:
+    """
+    Calls func on every argument tuple of items over a thread pool.
+
+    bcrypt releases the GIL while hashing, so the calls run in parallel.
+    An exception raised for one item is reported in its BatchResult and
+    does not abort the others.
+
+    Returns:
+    One BatchResult per item, in input order.
+    """
+    def call(args: tuple) -> BatchResult:
+        try:
+            return BatchResult(func(*args), None)
+        except Exception as e:
+            return BatchResult(None, e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(call, items))
+
+
+def hash_password_many(passwords: Sequence[str],
+                       workers: int = None) -> List[BatchResult]:
+    """
+    Hashes many passwords with bcrypt in parallel.
+
+    Arguments:
+    passwords -- The passwords to hash.
+    workers -- Number of hashing threads (default is the executor's).
+
+    Returns:
+    One BatchResult per password, in input order, whose value is the
+    hashed password.
+    """
+    return _run_batch(hash_password, [(p,) for p in passwords], workers)
+
+
+def is_valid_many(pairs: Sequence[Tuple[bytes, str]],
+                  workers: int = None) -> List[BatchResult]:
+    """
+    Checks many passwords against their hashed passwords in parallel.
+
+    Arguments:
+    pairs -- (hashed_password, password) tuples to check.
+    workers -- Number of checking threads (default is the executor's).
+
+    Returns:
+    One BatchResult per pair, in input order, whose value is the result
+    of is_valid.
+    """
+    return _run_batch(is_valid, list(pairs), workers)
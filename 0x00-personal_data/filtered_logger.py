@@ -3,14 +3,56 @@
 Module for handling Personal Data
 """
 import re
-from typing import List
+import sys
+import copy
+import queue
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Any, Callable, List, Pattern, TextIO, Tuple
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from os import environ
 import mysql.connector
+from db_pool import ConnectionPool, PooledConnection
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
 
 
+@lru_cache(maxsize=None)
+def _redaction_rules(
+    fields: Tuple[str, ...], redaction: str, separator: str
+) -> Tuple[Tuple[str, Pattern, str], ...]:
+    """
+    Compiles the substitutions used by filter_datum, once per argument set.
+
+    Each field gets its own pattern starting with the literal "field=",
+    which lets the re module locate candidates with a fast substring
+    search; a single alternation of all fields is slower to scan. A value
+    runs up to the next separator or, for the last token, to the end of
+    its line, so a block of lines is redacted exactly as each line would
+    be on its own; the \r of a CRLF line ending is left in place.
+
+    Returns:
+    A (prefix, pattern, literal replacement) tuple per field.
+    """
+    sep = re.escape(separator)
+    if len(separator) == 1:
+        # short of the \r ending the line, but not of one in the value
+        value = r"[^{0}\n]*(?:(?={0}|\r$)|(?<!\r)$)".format(sep)
+    else:
+        value = r".*?(?={}|\r?$)".format(sep)
+    rules = []
+    for f in fields:
+        prefix = "{}=".format(f)
+        pattern = re.compile(re.escape(prefix) + value, re.MULTILINE)
+        replacement = (prefix + redaction).replace("\\", r"\\")
+        rules.append((prefix, pattern, replacement))
+    return tuple(rules)
+
+
 def filter_datum(
     fields: List[str], redaction: str, message: str, separator: str
 ) -> str:
@@ -26,13 +68,15 @@ def filter_datum(
     Returns:
     The message with the specified fields obfuscated.
     """
-    for f in fields:
-        message = re.sub(f"{f}=.*?{separator}",
-                         f"{f}={redaction}{separator}", message)
+    for prefix, pattern, replacement in _redaction_rules(
+            tuple(fields), redaction, separator):
+        if prefix in message:
+            message = pattern.sub(replacement, message)
     return message
 
 
-def get_logger() -> logging.Logger:
+def get_logger(queued: bool = False, maxsize: int = 10000,
+               overflow: str = "block") -> logging.Logger:
     """
     Creates and returns a logger object with specific settings.
 
@@ -41,6 +85,17 @@ def get_logger() -> logging.Logger:
     to the root logger. A stream handler with a specific formatter is added
     to the logger. This formatter obfuscates fields defined in PII_FIELDS.
 
+    When queued is True the stream handler is driven by a background
+    listener thread instead: the calling thread only enqueues the record
+    into a BoundedQueueHandler, and redaction and I/O happen off the
+    request path. Pending records are flushed when logging shuts down.
+
+    Arguments:
+    queued -- Use a non-blocking, queue-backed handler.
+    maxsize -- Capacity of the queue when queued is True.
+    overflow -- What to do when the queue is full: "block", "drop"
+      or "sample" (see BoundedQueueHandler).
+
     Returns:
         logging.Logger: The configured logger object.
     """
@@ -50,7 +105,12 @@ def get_logger() -> logging.Logger:
 
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
-    logger.addHandler(stream_handler)
+    if queued:
+        queue_handler = BoundedQueueHandler(maxsize, overflow)
+        queue_handler.start(stream_handler)
+        logger.addHandler(queue_handler)
+    else:
+        logger.addHandler(stream_handler)
 
     return logger
 
@@ -84,52 +144,297 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return db
 
 
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_db_pool(factory: Callable[[], Any] = None) -> ConnectionPool:
+    """
+    Returns the process-wide connection pool, creating it on first use.
+
+    Uses the following environment variables for the pool settings:
+    - PERSONAL_DATA_DB_POOL_NAME: The name of the pool
+      (default is "personal_data").
+    - PERSONAL_DATA_DB_POOL_SIZE: The maximum number of connections
+      (default is 5).
+
+    Arguments:
+    factory -- Callable opening a new connection (default is get_db). It
+      is only used when the pool does not exist yet, which lets another
+      backend such as sqlite3 be plugged in.
+
+    Returns:
+        The ConnectionPool registered under the configured name.
+    """
+    name = environ.get("PERSONAL_DATA_DB_POOL_NAME", "personal_data")
+    size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5))
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ConnectionPool(factory or get_db, size, name)
+            _pools[name] = pool
+    return pool
+
+
+def get_pooled_db() -> PooledConnection:
+    """
+    Checks a health-checked connection out of the pool returned by
+    get_db_pool. Closing it hands it back to the pool.
+
+    Returns:
+        A PooledConnection behaving like the connection returned by get_db.
+    """
+    return get_db_pool().get_connection()
+
+
+def _streaming_cursor(db: Any) -> Any:
+    """
+    Returns an unbuffered cursor so rows are pulled from the server as
+    they are fetched instead of being loaded into memory up front.
+    Connections whose cursor() takes no buffering option (e.g. sqlite3)
+    get their default cursor, which already streams.
+    """
+    try:
+        return db.cursor(buffered=False)
+    except TypeError:
+        return db.cursor()
+
+
+def export_users(db: Any, batch_size: int = 1000, stream: TextIO = None,
+                 report: TextIO = None) -> int:
+    """
+    Streams every row of the 'users' table as redacted log lines.
+
+    Rows are fetched batch_size at a time from an unbuffered cursor and
+    logged as structured payloads, so they are redacted by column name
+    without any regex scan. Each batch is written to the stream with a
+    single write. A rows/sec
+    summary is written to report once the export is done.
+
+    Arguments:
+    db -- A DB-API connection, such as the one returned by get_db.
+    batch_size -- Number of rows fetched and written at once.
+    stream -- Destination of the log lines (default is sys.stdout).
+    report -- Destination of the summary (default is sys.stderr).
+
+    Returns:
+    The number of exported rows.
+    """
+    stream = stream or sys.stdout
+    report = report or sys.stderr
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    start = time.perf_counter()
+    count = 0
+
+    cursor = _streaming_cursor(db)
+    try:
+        cursor.execute("SELECT * FROM users;")
+        columns = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            lines = []
+            for row in rows:
+                log_record = logging.LogRecord("user_data", logging.INFO,
+                                               None, None,
+                                               dict(zip(columns, row)),
+                                               None, None)
+                lines.append(formatter.format(log_record))
+            stream.write("\n".join(lines) + "\n")
+            count += len(rows)
+    finally:
+        cursor.close()
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    report.write("Exported {} rows in {:.3f}s ({:.0f} rows/sec)\n".format(
+        count, elapsed, rate))
+    return count
+
+
 def main():
     """
     Retrieves all rows in the 'users' table of the database and logs each row.
 
     The log message is formatted by a RedactingFormatter to obfuscate
-      fields defined in PII_FIELDS.
+      fields defined in PII_FIELDS. Rows are streamed in batches whose size
+      is read from PERSONAL_DATA_EXPORT_BATCH_SIZE (default is 1000).
     """
+    batch_size = int(environ.get("PERSONAL_DATA_EXPORT_BATCH_SIZE", 1000))
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM users;")
+    try:
+        export_users(db, batch_size)
+    finally:
+        db.close()
 
-    fields = ["name", "email", "phone", "ssn", "password"]
-    formatter = RedactingFormatter(fields)
 
-    logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.addHandler(logging.StreamHandler())
-
-    for row in cursor:
-        message = ";".join(f"{f}={v}" for f, v in zip(fields, row))
-        log_record = logging.LogRecord("user_data", logging.INFO,
-                                       None, None, message, None, None)
-        print(formatter.format(log_record))
-
-    cursor.close()
-    db.close()
+class RedactingFormatter(logging.Formatter):
+    """Redacting Formatter class
 
+    Messages in which no "field=" prefix occurs skip the substitution
+    entirely, and the redacted form of the last cache_size messages is
+    kept in an LRU cache for frequently repeated log lines. The stats
+    dictionary counts formatted records, skipped records and cache hits.
 
-class RedactingFormatter(logging.Formatter):
-    """Redacting Formatter class"""
+    Structured payloads bypass the regex altogether: a dict logged as the
+    message, or passed as extra={"payload": {...}}, is redacted by key
+    lookup and rendered once as "key=value;" pairs joined by SEPARATOR.
+    """
 
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    CACHE_SIZE = 1024
+    PAYLOAD_ATTR = "payload"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], cache_size: int = None):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.cache_size = self.CACHE_SIZE if cache_size is None \
+            else cache_size
+        self.stats = {"records": 0, "skipped": 0, "cache_hits": 0,
+                      "structured": 0}
+        self._prefixes = tuple("{}=".format(f) for f in fields)
+        self._field_set = frozenset(fields)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
-    def format(self, record: logging.LogRecord) -> str:
-        """Filters values in incoming log records using filter_datum"""
-        record.msg = filter_datum(
-            self.fields, self.REDACTION, record.getMessage(), self.SEPARATOR
+    def redact(self, message: str) -> str:
+        """Returns the message with the formatter fields obfuscated"""
+        with self._lock:
+            self.stats["records"] += 1
+            if not any(p in message for p in self._prefixes):
+                self.stats["skipped"] += 1
+                return message
+            redacted = self._cache.get(message)
+            if redacted is not None:
+                self.stats["cache_hits"] += 1
+                self._cache.move_to_end(message)
+                return redacted
+        redacted = filter_datum(
+            self.fields, self.REDACTION, message, self.SEPARATOR
         )
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[message] = redacted
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return redacted
+
+    def render(self, payload: Mapping) -> str:
+        """Renders a structured payload with the formatter fields redacted"""
+        with self._lock:
+            self.stats["structured"] += 1
+        redacted = self._field_set
+        return "".join(
+            "{}={}{}".format(
+                k, self.REDACTION if k in redacted else v, self.SEPARATOR)
+            for k, v in payload.items()
+        )
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Filters values in incoming log records using filter_datum
+
+        The record itself is left untouched; a copy carrying the redacted
+        message is formatted instead.
+        """
+        payload = getattr(record, self.PAYLOAD_ATTR, None)
+        record = copy.copy(record)
+        if isinstance(record.msg, Mapping):
+            record.msg = self.render(record.msg)
+        elif isinstance(payload, Mapping):
+            message = self.redact(record.getMessage())
+            record.msg = " ".join(m for m in (message, self.render(payload))
+                                  if m)
+        else:
+            record.msg = self.redact(record.getMessage())
+        record.args = None
         return super(RedactingFormatter, self).format(record)
 
 
+class BoundedQueueHandler(QueueHandler):
+    """Queue handler with a bounded queue and an overflow policy
+
+    Records are put on a queue.Queue and handed to the target handlers by
+    a QueueListener thread. When the queue is full, the overflow policy
+    decides what happens to a new record:
+    - "block": wait for room in the queue.
+    - "drop": discard the new record.
+    - "sample": keep one out of every sample_rate overflowing records,
+      evicting the oldest queued record to make room, and discard the
+      others.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop", "sample")
+
+    def __init__(self, maxsize: int = 10000, overflow: str = "block",
+                 sample_rate: int = 10):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        super(BoundedQueueHandler, self).__init__(queue.Queue(maxsize))
+        self.overflow = overflow
+        self.sample_rate = max(sample_rate, 1)
+        self.listener = None
+        self.dropped = 0
+        self._overflowed = 0
+
+    def start(self, *handlers: logging.Handler):
+        """Starts the listener thread feeding the given handlers"""
+        self.listener = QueueListener(self.queue, *handlers,
+                                      respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merges the message arguments, leaving formatting to the listener"""
+        record = copy.copy(record)
+        if isinstance(record.msg, Mapping) and not record.args:
+            record.msg = dict(record.msg)
+        else:
+            record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Queues a record, applying the overflow policy when full"""
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.overflow == "sample":
+                self._sample(record)
+
+    def _sample(self, record: logging.LogRecord):
+        """Admits every sample_rate-th overflowing record"""
+        self._overflowed += 1
+        if self._overflowed % self.sample_rate:
+            return
+        try:
+            self.queue.get_nowait()
+            self.queue.task_done()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def flush(self):
+        """Waits until every queued record has been handled"""
+        if self.listener is not None:
+            self.queue.join()
+
+    def close(self):
+        """Flushes pending records and stops the listener thread"""
+        if self.listener is not None:
+            self.flush()
+            self.listener.stop()
+            self.listener = None
+        super(BoundedQueueHandler, self).close()
+
+
 if __name__ == "__main__":
     main()
@@ -93,13 +93,14 @@ class BasicAuth(Auth):
         """
         if type(user_email) == str and type(user_pwd) == str:
             try:
-                users = User.search({"email": user_email})
+                user = next(User.iter_search({"email": user_email},
+                                             limit=1), None)
             except Exception:
                 return None
-            if len(users) <= 0:
+            if user is None:
                 return None
-            if users[0].is_valid_password(user_pwd):
-                return users[0]
+            if user.is_valid_password(user_pwd):
+                return user
         return None
 
     def current_user(self, request=None) -> TypeVar("User"):
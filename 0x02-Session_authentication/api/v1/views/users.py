@@ -3,18 +3,139 @@
 Module of Users' views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from flask import Response, abort, jsonify, request
+from models.base import format_timestamp
 from models.user import User
+from urllib.parse import urlencode
+from werkzeug.http import is_resource_modified
+import json
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+MAX_PAGE_SIZE = 1000
+
+
+def _encode_cursor(sort: str, user: User) -> str:
+    """ Cursor resuming a listing ordered by sort after user
+    """
+    value = getattr(user, sort.lstrip("-"), None)
+    if type(value) is datetime:
+        value = format_timestamp(value)
+    data = json.dumps([sort, value, user.id], separators=(",", ":"))
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> list:
+    """ [sort, value, id] of a cursor, or None if it is invalid
+    """
+    try:
+        data = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort, value, user_id = json.loads(data.decode())
+        User._raw_value(sort.lstrip("-"), value)
+    except Exception:
+        return None
+    if type(sort) is not str or type(user_id) is not str:
+        return None
+    return [sort, value, user_id]
+
+
+def _not_modified(etag: str, last_modified: datetime = None) -> Response:
+    """ Empty 304 response when If-None-Match or If-Modified-Since show
+    that the client's copy is current, or None
+    """
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=last_modified):
+        return None
+    return Response(status=304)
+
+
+def _validated(response: Response, etag: str,
+               last_modified: datetime = None) -> Response:
+    """ response with its ETag and Last-Modified validators
+    """
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: maximum number of User objects, up to MAX_PAGE_SIZE
+      - cursor: cursor of the next page, given by the previous page
+      - sort: attribute to order by, among User.SORTED_ATTRIBUTES,
+        prefixed by "-" for the descending order (created_at when a
+        limit or a cursor is given, insertion order otherwise)
+      - fields: comma-separated attributes to return
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, streamed in chunks
+      - one User object JSON represented per line when
+        application/x-ndjson is preferred in Accept
+      - the next page in the Link header (rel="next") and its cursor in
+        the X-Next-Cursor header, when there is one
+      - an ETag changing with the generation of the users
+      - 304 if the ETag in If-None-Match is current
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    mimetype = request.accept_mimetypes.best_match(
+        ("application/json", NDJSON_MIMETYPE), "application/json")
+    fields = None
+    if request.args.get("fields"):
+        fields = request.args.get("fields").split(",")
+        public = [n for n in User._attribute_names() if n[0] != "_"]
+        for field in fields:
+            if field not in public:
+                return jsonify({'error': "Unknown field: {}".format(
+                    field)}), 400
+    limit = request.args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': "limit must be between 1 and {}".format(
+                MAX_PAGE_SIZE)}), 400
+    sort = request.args.get("sort")
+    cursor = request.args.get("cursor")
+    after = None
+    if cursor is not None:
+        after = _decode_cursor(cursor)
+        if after is None or (sort is not None and sort != after[0]):
+            return jsonify({'error': "Invalid cursor"}), 400
+        sort = after[0]
+    if sort is None and limit is None:
+        users = User.iter_all()
+    else:
+        sort = sort or "created_at"
+        if sort.lstrip("-") not in User.SORTED_ATTRIBUTES:
+            return jsonify({'error': "Unknown sort: {}".format(sort)}), 400
+        query = User.query().order_by(sort.lstrip("-"), sort[0] == "-")
+        if after is not None:
+            query.after(after[1], after[2])
+        users = query
+    etag = "{}.{}".format(User.generation(), mimetype.split("/")[-1])
+    response = _not_modified(etag)
+    if response is None:
+        headers = {}
+        if limit is not None:
+            users = query.limit(limit + 1).all()
+            if len(users) > limit:
+                users = users[:limit]
+                next_cursor = _encode_cursor(sort, users[-1])
+                args = request.args.to_dict()
+                args["cursor"] = next_cursor
+                headers["Link"] = '<{}?{}>; rel="next"'.format(
+                    request.base_url, urlencode(args))
+                headers["X-Next-Cursor"] = next_cursor
+        chunks = User.iter_json(users, lines=mimetype == NDJSON_MIMETYPE,
+                                fields=fields)
+        response = Response(chunks, mimetype=mimetype, headers=headers)
+    response.vary.add("Accept")
+    return _validated(response, etag)
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -23,20 +144,28 @@ def view_one_user(user_id: str = None) -> str:
     Path parameter:
       - User ID
     Return:
-      - User object JSON represented
+      - User object JSON represented, with an ETag from its revision
+        and Last-Modified from updated_at
+      - 304 if If-None-Match or If-Modified-Since show it is unchanged
       - 404 if the User ID doesn't exist
     """
     if user_id == "me":
         if not request.current_user:
             abort(404)
-        else:
-            return jsonify(request.current_user.to_json())
-    if user_id is None:
-        abort(404)
-    user = User.get(user_id)
-    if user is None:
-        abort(404)
-    return jsonify(user.to_json())
+        user = request.current_user
+    else:
+        if user_id is None:
+            abort(404)
+        user = User.get(user_id)
+        if user is None:
+            abort(404)
+    # unlike updated_at, the revision tells apart two saves within the
+    # same second
+    etag = "{}.{}".format(user.id, user.revision)
+    response = _not_modified(etag, user.updated_at)
+    if response is None:
+        response = jsonify(user.to_json())
+    return _validated(response, etag, user.updated_at)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -95,6 +224,92 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    Body: JSON array, or one JSON object per line with the
+    application/x-ndjson content type, of objects with:
+      - email
+      - password
+      - last_name (optional)
+      - first_name (optional)
+    Return:
+      - ids of the created User objects and the errors of the rejected
+        rows, by position: {"created": [...], "errors": [{"row", "error"}]}
+      - 201 if at least one User is created, 200 otherwise
+      - 400 if the body can't be read
+    """
+    rows = None
+    if request.mimetype == NDJSON_MIMETYPE:
+        rows = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+    else:
+        try:
+            rows = request.get_json()
+        except Exception as e:
+            rows = None
+    if type(rows) is not list:
+        return jsonify({'error': "Wrong format"}), 400
+    users = []
+    errors = []
+    emails = set()
+    for i, rj in enumerate(rows):
+        error_msg = None
+        if type(rj) is not dict:
+            error_msg = "Wrong format"
+        elif rj.get("email", "") == "" or type(rj.get("email")) is not str:
+            error_msg = "email missing"
+        elif rj.get("password", "") == "" or \
+                type(rj.get("password")) is not str:
+            error_msg = "password missing"
+        elif rj.get("email") in emails or \
+                next(User.iter_search({"email": rj.get("email")},
+                                      limit=1), None) is not None:
+            error_msg = "email already exists"
+        if error_msg is not None:
+            errors.append({"row": i, "error": error_msg})
+            continue
+        user = User()
+        user.email = rj.get("email")
+        user.password = rj.get("password")
+        user.first_name = rj.get("first_name")
+        user.last_name = rj.get("last_name")
+        emails.add(user.email)
+        users.append(user)
+    try:
+        User.save_all(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    result = {"created": [user.id for user in users], "errors": errors}
+    return jsonify(result), 201 if users else 200
+
+
+@app_views.route('/users/export', methods=['GET'], strict_slashes=False)
+def export_users() -> str:
+    """ GET /api/v1/users/export
+    Return:
+      - every User object JSON represented, one per line, streamed
+      - a JSON array instead when application/json is preferred in
+        Accept
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        (NDJSON_MIMETYPE, "application/json"), NDJSON_MIMETYPE)
+    chunks = User.iter_json(User.iter_all(),
+                            lines=mimetype == NDJSON_MIMETYPE,
+                            chunk_size=1000)
+    filename = "users.ndjson" if mimetype == NDJSON_MIMETYPE \
+        else "users.json"
+    headers = {"Content-Disposition":
+               "attachment; filename={}".format(filename)}
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+""" Benchmarks for the models
+
+Measures the memory taken by User objects, projected per million users,
+against a plain __dict__-based object holding the same attributes and
+the memory the cached JSON text adds, and times timestamp
+parsing/formatting, to_json(), to_json_str() on new and on already
+encoded objects, and the encoding of the list of every user.
+
+Usage:
+    ./benchmark_models.py [--users N] [--json results.json]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from models.base import (TIMESTAMP_FORMAT, format_timestamp,
+                         parse_timestamp)
+from models.user import User
+
+
+class DictUser():
+    """ User laid out in a per-instance __dict__, as a baseline
+    """
+
+    def __init__(self, **kwargs: dict):
+        """ Initialize a DictUser the way User used to be initialized
+        """
+        self.id = kwargs.get('id')
+        self.created_at = datetime.strptime(kwargs.get('created_at'),
+                                            TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(kwargs.get('updated_at'),
+                                            TIMESTAMP_FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def make_records(count: int) -> List[Dict]:
+    """ Serialized users, as stored in .db_User.json
+    """
+    return [{
+        "id": str(uuid.uuid4()),
+        "created_at": "2023-11-09T10:23:19",
+        "updated_at": "2023-11-09T10:23:19",
+        "email": "user{}@hbtn.io".format(i),
+        "_password": "a5c904771b8617de27d3511d1f538094e"
+                     "26c120da663363b3f760f7b894f9d69",
+        "first_name": "First{}".format(i),
+        "last_name": "Last{}".format(i),
+    } for i in range(count)]
+
+
+def measure_memory(cls: type, records: List[Dict]) -> float:
+    """ Bytes allocated per object when building cls from records
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [cls(**record) for record in records]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / len(records)
+
+
+def measure_cache_memory(objs: list) -> float:
+    """ Bytes allocated per object when caching the JSON text of objs
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for obj in objs:
+        obj.to_json_str()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(objs)
+
+
+def measure_time(func: Callable, items: list) -> float:
+    """ Nanoseconds per call of func on each item
+    """
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) * 1e9 / len(items)
+
+
+def main():
+    """ Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the models.")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    records = make_records(args.users)
+    results = {}
+    for name, cls in (("dict_user", DictUser), ("user", User)):
+        per_object = measure_memory(cls, records)
+        results["{}_bytes_per_object".format(name)] = per_object
+        results["{}_mib_per_million".format(name)] = per_object * 1e6 / 2**20
+    stamps = [r["created_at"] for r in records]
+    dates = [parse_timestamp(s) for s in stamps]
+    results["user_json_cache_bytes_per_object"] = measure_cache_memory(
+        [User(**r) for r in records])
+    users = [User(**r) for r in records]
+    results.update({
+        "strptime_ns": measure_time(
+            lambda s: datetime.strptime(s, TIMESTAMP_FORMAT), stamps),
+        "parse_timestamp_ns": measure_time(parse_timestamp, stamps),
+        "strftime_ns": measure_time(
+            lambda d: d.strftime(TIMESTAMP_FORMAT), dates),
+        "format_timestamp_ns": measure_time(format_timestamp, dates),
+        "to_json_ns": measure_time(lambda u: u.to_json(), users),
+        "to_json_str_ns": measure_time(lambda u: u.to_json_str(), users),
+        "to_json_str_cached_ns": measure_time(
+            lambda u: u.to_json_str(), users),
+        "json_dumps_list_ns": measure_time(
+            lambda objs: json.dumps([u.to_json() for u in objs],
+                                    sort_keys=True, separators=(",", ":")),
+            [users]) / len(users),
+        "json_array_ns": measure_time(User.json_array, [users]) / len(users),
+        "json_array_cached_ns": measure_time(
+            User.json_array, [users]) / len(users),
+    })
+    for key, value in results.items():
+        print("{:<32} {:>12.1f}".format(key, value))
+
+    if args.json:
+        report = {
+            "created_at": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "users": args.users,
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
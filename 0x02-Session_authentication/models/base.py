@@ -2,38 +2,203 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from itertools import islice
+from operator import attrgetter
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path, remove, stat
+from models.binary_snapshot import BinarySnapshot, SnapshotDict, \
+    write_snapshot
+from models.file_store import FileLock, atomic_open
+from models.sorted_index import SortedIndex
+from models.sqlite_storage import SQLiteStorage
+from models.write_behind import WriteBehindFlusher
 import json
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+INDEXED_VALUES = {}
+SORTED_INDEXES = {}
+JOURNAL_SIZES = {}
+FILE_STATES = {}
+LOCKS = {}
+MEMORY_LOCKS = {}
+GENERATIONS = {}
+PROCESS_ID = uuid.uuid4().hex[:8]
+PERSISTENCE = getenv("MODELS_PERSISTENCE", "snapshot")
+SNAPSHOT_FORMAT = getenv("MODELS_SNAPSHOT_FORMAT", "json")
+LAZY_LOAD = getenv("MODELS_LAZY_LOAD") == "1" or SNAPSHOT_FORMAT == "binary"
+JOURNAL_COMPACT_THRESHOLD = int(getenv("MODELS_JOURNAL_COMPACT_THRESHOLD",
+                                       1000))
+WRITE_BEHIND_INTERVAL = float(getenv("MODELS_WRITE_BEHIND_INTERVAL", 0))
+STORAGE = getenv("MODELS_STORAGE", "json")
+ENGINE = None
+if STORAGE == "sqlite":
+    ENGINE = SQLiteStorage(getenv("MODELS_SQLITE_PATH", ".db.sqlite3"))
+FLUSHER = None
+if ENGINE is None and WRITE_BEHIND_INTERVAL > 0:
+    FLUSHER = WriteBehindFlusher(
+        WRITE_BEHIND_INTERVAL,
+        int(getenv("MODELS_WRITE_BEHIND_MAX_DIRTY", 1000)))
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, with the much faster
+    fromisoformat when the format is the ISO 8601 default
+    """
+    if TIMESTAMP_FORMAT == "%Y-%m-%dT%H:%M:%S":
+        value = datetime.fromisoformat(value)
+        if value.microsecond:
+            value = value.replace(microsecond=0)
+        return value
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def utcnow() -> datetime:
+    """ Current UTC time, to the second like TIMESTAMP_FORMAT, so that
+    objects compare and sort the same before and after being stored
+    """
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def format_timestamp(value: datetime) -> str:
+    """ Format a datetime as TIMESTAMP_FORMAT, with the much faster
+    isoformat when the format is the ISO 8601 default
+    """
+    if TIMESTAMP_FORMAT == "%Y-%m-%dT%H:%M:%S" and value.tzinfo is None:
+        return value.isoformat(timespec="seconds")
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def iter_items(objs: dict) -> Iterator[tuple]:
+    """ Iterate lazily over the (id, object) items of objs, which other
+    threads may change meanwhile: once they do, the iteration goes on
+    over a copy of the ids not yet iterated
+    """
+    if isinstance(objs, SnapshotDict):
+        # a snapshot dictionary tolerates changes while iterated
+        yield from objs.items()
+        return
+    seen = set()
+    try:
+        for obj_id, obj in objs.items():
+            seen.add(obj_id)
+            yield obj_id, obj
+        return
+    except RuntimeError:
+        pass
+    for obj_id in list(objs):
+        if obj_id in seen:
+            continue
+        obj = objs.get(obj_id)
+        if obj is not None:
+            yield obj_id, obj
+
+
+def paginate(objs: Iterable[TypeVar('Base')], limit: int = None,
+             offset: int = 0,
+             after: str = None) -> Iterator[TypeVar('Base')]:
+    """ Page of objs: the ones following the object of id after when
+    given, skipping offset of them and stopping after limit
+
+    The objects up to the one of id after are walked through, so that
+    resuming deep into a large store is linear in the position of the
+    cursor; Query.after() seeks the cursor in a sorted index instead.
+    """
+    objs = iter(objs)
+    if after is not None:
+        for obj in objs:
+            if obj.id == after:
+                break
+    stop = None if limit is None else offset + limit
+    return islice(objs, offset, stop)
 
 
 class Base():
     """ Base class
+
+    Subclasses can list attributes in INDEXED_ATTRIBUTES to keep a hash
+    index of them: search() then looks matching objects up by value
+    instead of scanning every object. Indexes reflect the objects as
+    they were last saved or loaded.
+
+    Objects of a class are persisted in a .db_<class>.json snapshot.
+    With MODELS_PERSISTENCE=journal, save() and remove() append a single
+    record to a .db_<class>.journal file instead of rewriting the
+    snapshot; load_from_file() replays the journal over the snapshot,
+    and the journal is folded back into the snapshot once it holds
+    MODELS_JOURNAL_COMPACT_THRESHOLD records.
+
+    With MODELS_WRITE_BEHIND_INTERVAL set to a number of seconds, save()
+    and remove() only mark objects dirty; a background thread writes
+    them at most once per interval, or as soon as
+    MODELS_WRITE_BEHIND_MAX_DIRTY objects are pending. flush() writes
+    pending changes immediately, and so does a clean shutdown.
+
+    With MODELS_LAZY_LOAD=1, load_from_file() keeps the loaded records
+    as raw dictionaries in DATA and only builds an object the first time
+    get() or search() returns it. Indexes are likewise built by the first
+    search() using them, so startup does not depend on the number of
+    stored objects beyond parsing the file.
+
+    With MODELS_SNAPSHOT_FORMAT=binary, the snapshot is a .db_<class>.bin
+    file (see models.binary_snapshot) that load_from_file() maps into
+    memory instead of parsing, so loading is lazy and a record is only
+    decoded when it is first accessed.
+
+    Several processes can share the files: writes hold an advisory lock
+    on .db_<class>.lock and first load what other processes wrote, the
+    snapshot is replaced atomically, and reads first check the snapshot
+    signature (inode, mtime and size) and the journal size to reload the
+    snapshot, or replay only the new journal records, when they changed.
+    Within a process, threads change the loaded objects and their
+    indexes one at a time, under the memory lock of the class.
+
+    With MODELS_STORAGE=sqlite, objects are stored in the SQLite
+    database MODELS_SQLITE_PATH (default .db.sqlite3) instead, with an
+    indexed column per attribute of INDEXED_ATTRIBUTES, and every
+    method reads from and writes to it directly; the JSON options above
+    do not apply. `python3 -m models.migrate` copies objects between the
+    two storages.
+
+    SORTED_ATTRIBUTES lists attributes kept in sorted indexes, built on
+    first use, that answer the range, prefix and ordering conditions of
+    query() (see models.query).
+
+    Attributes live in __slots__ rather than in a per-instance __dict__:
+    subclasses declare their own attributes in __slots__ too, and
+    to_json() serializes every slot of the class hierarchy. The JSON
+    text of an object, to_json_str(), is cached until one of its
+    attributes changes, which a comparison with the values it was built
+    from detects, so unchanged objects are only encoded once.
     """
 
+    __slots__ = ("id", "created_at", "updated_at", "_revision",
+                 "_json_cache")
+    INDEXED_ATTRIBUTES = ()
+    SORTED_ATTRIBUTES = ("created_at", "updated_at")
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__._reset_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
-            self.created_at = datetime.utcnow()
+            self.created_at = utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
-            self.updated_at = datetime.utcnow()
+            self.updated_at = utcnow()
+        self._revision = kwargs.get('_revision') or 0
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,67 +209,634 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _attribute_names(cls) -> tuple:
+        """ Names of the slots of the class and of its parents, computed
+        once per class
+        """
+        names = cls.__dict__.get("_ATTRIBUTE_NAMES")
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                slots = klass.__dict__.get("__slots__", ())
+                if type(slots) is str:
+                    slots = (slots,)
+                for name in slots:
+                    if name not in names and name not in \
+                            ("__dict__", "__weakref__", "_json_cache"):
+                        names.append(name)
+            names = tuple(names)
+            cls._ATTRIBUTE_NAMES = names
+            cls._ATTRIBUTE_GETTER = attrgetter(*names)
+        return names
+
+    def _fingerprint(self) -> tuple:
+        """ Current values of every attribute of the object
+        """
+        names = self._attribute_names()
+        try:
+            values = self._ATTRIBUTE_GETTER(self)
+        except AttributeError:
+            values = tuple(getattr(self, key, None) for key in names)
+        extra = getattr(self, "__dict__", None)
+        if extra:
+            values += (tuple(extra.items()),)
+        return values
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        return self._build_json(for_serialization)
+
+    def to_json_str(self) -> str:
+        """ to_json() encoded as JSON text, the way Flask's jsonify()
+        encodes it by default, cached with the attribute values it was
+        encoded from
+        """
+        fingerprint = self._fingerprint()
+        cache = getattr(self, "_json_cache", None)
+        if cache is not None and cache[0] == fingerprint:
+            return cache[1]
+        text = json.dumps(self._build_json(False), sort_keys=True,
+                          separators=(",", ":"))
+        self._json_cache = (fingerprint, text)
+        return text
+
+    @staticmethod
+    def json_array(objs: Iterable[TypeVar('Base')]) -> str:
+        """ JSON array of the to_json() of objs, joined from their cached
+        JSON text
+        """
+        return "[" + ",".join(obj.to_json_str() for obj in objs) + "]"
+
+    @staticmethod
+    def iter_json(objs: Iterable[TypeVar('Base')], lines: bool = False,
+                  chunk_size: int = 100,
+                  fields: List[str] = None) -> Iterator[str]:
+        """ Chunks of the JSON array of the to_json() of objs, or of their
+        JSON lines (NDJSON) when lines is True, each one encoding up to
+        chunk_size objects, so that objs are only read as chunks are
+        consumed; with fields, only those keys of to_json() are kept
+        """
+        if fields is None:
+            def encode(obj):
+                return obj.to_json_str()
+        else:
+            def encode(obj):
+                data = obj.to_json()
+                return json.dumps({k: data[k] for k in fields if k in data},
+                                  sort_keys=True, separators=(",", ":"))
+        objs = iter(objs)
+        first = True
+        while True:
+            chunk = [encode(obj) for obj in islice(objs, chunk_size)]
+            if not chunk:
+                break
+            if lines:
+                yield "\n".join(chunk) + "\n"
+            else:
+                yield ("[" if first else ",") + ",".join(chunk)
+            first = False
+        if not lines:
+            yield "[]\n" if first else "]\n"
+
+    def _build_json(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary of the object
+        """
         result = {}
-        for key, value in self.__dict__.items():
+        items = [(key, getattr(self, key, None))
+                 for key in self._attribute_names()]
+        items.extend(getattr(self, "__dict__", {}).items())
+        for key, value in items:
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
 
+    @classmethod
+    def _reset_indexes(cls):
+        """ Drop and recreate the empty indexes of the class
+        """
+        s_class = cls.__name__
+        INDEXES[s_class] = {attr: {} for attr in cls.INDEXED_ATTRIBUTES}
+        INDEXED_VALUES[s_class] = {a: {} for a in cls.INDEXED_ATTRIBUTES}
+        SORTED_INDEXES[s_class] = {a: None for a in cls.SORTED_ATTRIBUTES}
+
+    @staticmethod
+    def _value(obj, attr: str):
+        """ Value of attr of an object, or of its raw dictionary
+        """
+        if type(obj) is not dict:
+            return getattr(obj, attr, None)
+        return Base._raw_value(attr, obj.get(attr))
+
+    @staticmethod
+    def _raw_value(attr: str, value):
+        """ Value of attr in an object built from a serialized value
+        """
+        if attr in ("created_at", "updated_at") and type(value) is str:
+            return parse_timestamp(value)
+        return value
+
+    @classmethod
+    def _column(cls, attr: str, objs: dict = None) -> Iterator[tuple]:
+        """ Iterate over the ids of every stored object, or of objs, with
+        their value of attr, without building the objects
+        """
+        if objs is None:
+            objs = DATA[cls.__name__]
+        if isinstance(objs, SnapshotDict):
+            for obj_id, value in objs.column(attr):
+                yield obj_id, cls._raw_value(attr, value)
+        else:
+            for obj_id, obj in objs.items():
+                yield obj_id, cls._value(obj, attr)
+
+    @classmethod
+    def _build_index(cls, attr: str) -> dict:
+        """ Build the index of attr from every stored object, or its raw
+        dictionary
+        """
+        s_class = cls.__name__
+        with cls._memory_lock():
+            index = INDEXES[s_class][attr]
+            if index is None:
+                index, values = cls._make_index(attr)
+                INDEXES[s_class][attr] = index
+                INDEXED_VALUES[s_class][attr] = values
+        return index
+
+    @classmethod
+    def _make_index(cls, attr: str, objs: dict = None) -> tuple:
+        """ Index of attr, and the indexed value of each object, over
+        every stored object or over objs
+        """
+        index = {}
+        values = {}
+        for obj_id, value in cls._column(attr, objs):
+            try:
+                index.setdefault(value, {})[obj_id] = None
+            except TypeError:
+                continue
+            values[obj_id] = value
+        return index, values
+
+    @classmethod
+    def _sorted_index(cls, attr: str) -> SortedIndex:
+        """ Sorted index of attr, built on first use
+        """
+        index = SORTED_INDEXES[cls.__name__][attr]
+        if index is None:
+            with cls._memory_lock():
+                indexes = SORTED_INDEXES[cls.__name__]
+                if indexes[attr] is None:
+                    indexes[attr] = SortedIndex(cls._column(attr))
+                index = indexes[attr]
+        return index
+
+    @classmethod
+    def _index(cls, obj_id: str, obj: TypeVar('Base')):
+        """ Add an object to the built indexes of the class, replacing the
+        entries of its previously indexed values
+        """
+        cls._unindex(obj_id)
+        s_class = cls.__name__
+        for attr, index in INDEXES[s_class].items():
+            if index is None:
+                continue
+            value = cls._value(obj, attr)
+            try:
+                index.setdefault(value, {})[obj_id] = None
+            except TypeError:
+                continue
+            INDEXED_VALUES[s_class][attr][obj_id] = value
+        for attr, index in SORTED_INDEXES[s_class].items():
+            if index is not None:
+                index.add(obj_id, cls._value(obj, attr))
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """ Remove an object from the built indexes of the class
+        """
+        s_class = cls.__name__
+        for attr, index in INDEXES[s_class].items():
+            if index is None:
+                continue
+            values = INDEXED_VALUES[s_class][attr]
+            if obj_id not in values:
+                continue
+            value = values.pop(obj_id)
+            ids = index.get(value)
+            if ids is not None:
+                ids.pop(obj_id, None)
+                if not ids:
+                    del index[value]
+        for index in SORTED_INDEXES[s_class].values():
+            if index is not None:
+                index.remove(obj_id)
+
+    @classmethod
+    def _hydrate(cls, obj_id: str) -> TypeVar('Base'):
+        """ Return the object stored under obj_id, building it first if
+        it is still a raw dictionary
+        """
+        obj = DATA[cls.__name__].get(obj_id)
+        if type(obj) is dict:
+            with cls._memory_lock():
+                objs = DATA[cls.__name__]
+                obj = objs.get(obj_id)
+                if type(obj) is dict:
+                    obj = cls(**obj)
+                    objs[obj_id] = obj
+        return obj
+
+    @staticmethod
+    def _serialize(obj) -> dict:
+        """ Serialized form of an object or of its raw dictionary
+        """
+        return obj if type(obj) is dict else obj.to_json(True)
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
+
+        The objects and their indexes are built aside and then replace
+        the loaded ones, so that other threads reading meanwhile still
+        see the previous objects rather than an empty store.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        if ENGINE is not None:
+            DATA[s_class] = {}
+            cls._reset_indexes()
+            ENGINE.load(cls)
             return
+        objs_json, snapshot, offset, replayed = cls._read_records()
+        if LAZY_LOAD:
+            objs = objs_json
+        else:
+            objs = {obj_id: cls(**obj_json)
+                    for obj_id, obj_json in objs_json.items()}
+        if FLUSHER is not None:
+            for obj_id, obj in FLUSHER.changes(cls).items():
+                if obj is None:
+                    objs.pop(obj_id, None)
+                else:
+                    objs[obj_id] = obj
+        indexes = {attr: None for attr in cls.INDEXED_ATTRIBUTES}
+        values = {attr: {} for attr in cls.INDEXED_ATTRIBUTES}
+        if not LAZY_LOAD:
+            for attr in cls.INDEXED_ATTRIBUTES:
+                indexes[attr], values[attr] = cls._make_index(attr, objs)
+        with cls._memory_lock():
+            INDEXED_VALUES[s_class] = values
+            INDEXES[s_class] = indexes
+            SORTED_INDEXES[s_class] = {a: None
+                                       for a in cls.SORTED_ATTRIBUTES}
+            DATA[s_class] = objs
+            FILE_STATES[s_class] = (snapshot, offset)
+            JOURNAL_SIZES[s_class] = replayed
+            GENERATIONS[s_class] = GENERATIONS.get(s_class, 0) + 1
+
+    @classmethod
+    def _snapshot_path(cls, snapshot_format: str = None) -> str:
+        """ Path of the snapshot file of the class, in snapshot_format or
+        by default in MODELS_SNAPSHOT_FORMAT
+        """
+        if (snapshot_format or SNAPSHOT_FORMAT) == "binary":
+            return ".db_{}.bin".format(cls.__name__)
+        return ".db_{}.json".format(cls.__name__)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _journal_path(cls) -> str:
+        """ Path of the journal file of the class
+        """
+        return ".db_{}.journal".format(cls.__name__)
+
+    @classmethod
+    def _lock(cls, exclusive: bool = True):
+        """ Hold the lock of the files of the class, shared with the
+        other processes using them
+        """
+        s_class = cls.__name__
+        if s_class not in LOCKS:
+            LOCKS.setdefault(s_class, FileLock(".db_{}.lock".format(s_class)))
+        return LOCKS[s_class].hold(exclusive)
+
+    @classmethod
+    def _memory_lock(cls) -> threading.RLock:
+        """ Lock of the loaded objects of the class and of their indexes,
+        shared by the threads of the process
+
+        It is only held around changes in memory, never while waiting
+        for the files, so it is always taken after _lock().
+        """
+        s_class = cls.__name__
+        if s_class not in MEMORY_LOCKS:
+            MEMORY_LOCKS.setdefault(s_class, threading.RLock())
+        return MEMORY_LOCKS[s_class]
+
+    @staticmethod
+    def _signature(file_path: str) -> tuple:
+        """ Identity of the current content of a file, None when missing
+        """
+        try:
+            st = stat(file_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @classmethod
+    def _read_records(cls, snapshot_format: str = None) -> tuple:
+        """ Read the serialized objects of the class from its snapshot,
+        with its journal replayed on top
+
+        A binary snapshot is mapped rather than read: its records are
+        only decoded when accessed.
+
+        Returns:
+        The objects keyed by id, the signature of the snapshot, the
+        journal offset read up to and the number of journal records.
+        """
+        objs_json = {}
+        file_path = cls._snapshot_path(snapshot_format)
+        with cls._lock(exclusive=False):
+            snapshot = cls._signature(file_path)
+            if snapshot is None:
+                pass
+            elif file_path.endswith(".bin"):
+                objs_json = SnapshotDict(BinarySnapshot(file_path))
+            else:
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+            entries, offset = cls._read_journal()
+        for entry in entries:
+            if entry["op"] == "save":
+                objs_json[entry["obj"]["id"]] = entry["obj"]
+            else:
+                objs_json.pop(entry["id"], None)
+        return objs_json, snapshot, offset, len(entries)
+
+    @classmethod
+    def _read_journal(cls, offset: int = 0) -> tuple:
+        """ Read the complete journal records written after offset
+
+        Returns:
+        The records and the offset following the last one read.
+        """
+        try:
+            with open(cls._journal_path(), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # a line without its newline is still being written
+        end = data.rfind(b"\n") + 1
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # torn record left by an interrupted write
+                continue
+        return entries, offset + end
+
+    @classmethod
+    def _refresh(cls):
+        """ Catch up with the changes written by other processes: reload
+        everything when the snapshot was replaced, or only apply the
+        journal records appended since the last read
+        """
+        if ENGINE is not None:
+            return
+        s_class = cls.__name__
+        state = FILE_STATES.get(s_class)
+        if state is None or \
+                cls._signature(cls._snapshot_path()) != state[0]:
+            cls.load_from_file()
+            return
+        try:
+            size = stat(cls._journal_path()).st_size
+        except OSError:
+            size = 0
+        if size == state[1]:
+            return
+        with cls._lock(exclusive=False):
+            if size < state[1] or \
+                    cls._signature(cls._snapshot_path()) != state[0]:
+                cls.load_from_file()
+                return
+            entries, offset = cls._read_journal(state[1])
+            changes = {}
+            for entry in entries:
+                if entry["op"] == "save":
+                    obj = entry["obj"] if LAZY_LOAD else cls(**entry["obj"])
+                    changes[entry["obj"]["id"]] = obj
+                else:
+                    changes[entry["id"]] = None
+            with cls._memory_lock():
+                if FILE_STATES.get(s_class) != state:
+                    # another thread caught up meanwhile
+                    return
+                cls._apply(changes)
+                FILE_STATES[s_class] = (state[0], offset)
+                JOURNAL_SIZES[s_class] += len(entries)
+
+    @classmethod
+    def _apply(cls, changes: dict):
+        """ Apply changes ({object id: object or raw dictionary, or None
+        when removed}) to the loaded objects and their indexes
+        """
+        s_class = cls.__name__
+        with cls._memory_lock():
+            GENERATIONS[s_class] = GENERATIONS.get(s_class, 0) + 1
+            objs = DATA[s_class]
+            for obj_id, obj in changes.items():
+                if obj is None:
+                    objs.pop(obj_id, None)
+                    cls._unindex(obj_id)
+                else:
+                    objs[obj_id] = obj
+                    cls._index(obj_id, obj)
+
+    @classmethod
+    def _append_journal(cls, entries: List[dict]):
+        """ Append records to the journal, compacting it into the
+        snapshot when it grows past the threshold
+        """
+        s_class = cls.__name__
+        with open(cls._journal_path(), 'a') as f:
+            f.write("".join(json.dumps(e) + "\n" for e in entries))
+            f.flush()
+            FILE_STATES[s_class] = (FILE_STATES[s_class][0], f.tell())
+        JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + len(entries)
+        if JOURNAL_SIZES[s_class] >= JOURNAL_COMPACT_THRESHOLD:
+            cls.save_to_file()
+
+    @classmethod
+    def _persist(cls, changes: dict):
+        """ Persist changes ({object id: object, or None when removed})
+        now, or hand them to the write-behind flusher
+        """
+        if FLUSHER is not None:
+            FLUSHER.mark(cls, changes)
+        else:
+            cls._write(changes)
+
+    @classmethod
+    def _write(cls, changes: dict):
+        """ Write changes ({object id: object, or None when removed}) to
+        the journal or, in snapshot mode, rewrite the snapshot
+
+        The files are locked meanwhile, and the changes of other
+        processes are loaded first so that none of them is overwritten.
+        """
+        with cls._lock():
+            cls._refresh()
+            cls._apply(changes)
+            if PERSISTENCE != "journal":
+                cls.save_to_file()
+                return
+            entries = []
+            for obj_id, obj in changes.items():
+                if obj is not None:
+                    entries.append({"op": "save",
+                                    "obj": cls._serialize(obj)})
+                else:
+                    entries.append({"op": "remove", "id": obj_id})
+            cls._append_journal(entries)
+
+    @classmethod
+    def flush(cls):
+        """ Write the changes still pending in write-behind mode
+        """
+        if FLUSHER is not None:
+            FLUSHER.flush()
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
+        if ENGINE is not None:
+            # every change is already in the database
+            return
+        objs = DATA[cls.__name__]
+        if isinstance(objs, SnapshotDict):
+            objs_json = objs.with_values(cls._serialize)
+        else:
+            objs_json = {}
+            for obj_id, obj in list(objs.items()):
+                objs_json[obj_id] = cls._serialize(obj)
+        cls._write_records(objs_json)
+
+    @classmethod
+    def _write_records(cls, objs_json: dict, snapshot_format: str = None):
+        """ Write serialized objects as the snapshot of the class, in
+        snapshot_format or by default in MODELS_SNAPSHOT_FORMAT
+
+        The journal, which the objects include, is dropped when this is
+        the snapshot in use; replaying it over another snapshot does not
+        change the outcome.
+        """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        file_path = cls._snapshot_path(snapshot_format)
+        with cls._lock():
+            if file_path.endswith(".bin"):
+                write_snapshot(file_path, objs_json)
+            else:
+                with atomic_open(file_path) as f:
+                    if type(objs_json) is not dict:
+                        objs_json = dict(objs_json.items())
+                    json.dump(objs_json, f)
+            if file_path != cls._snapshot_path():
+                return
+            if path.exists(cls._journal_path()):
+                remove(cls._journal_path())
+            if s_class in FILE_STATES:
+                FILE_STATES[s_class] = (cls._signature(file_path), 0)
+        JOURNAL_SIZES[s_class] = 0
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @property
+    def revision(self) -> int:
+        """ Number of times the object was saved, stored with it
+        """
+        return self._revision
 
     def save(self):
-        """ Save current object
+        """ Save current object, as its next revision
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.updated_at = utcnow()
+        self._revision += 1
+        if ENGINE is not None:
+            ENGINE.save(self)
+            return
+        self.__class__._apply({self.id: self})
+        self.__class__._persist({self.id: self})
+
+    @classmethod
+    def save_all(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects of the class together, with a single write
+        """
+        changes = {}
+        for obj in objs:
+            obj.updated_at = utcnow()
+            obj._revision += 1
+            changes[obj.id] = obj
+        if not changes:
+            return
+        if ENGINE is not None:
+            ENGINE.save_all(changes.values())
+            return
+        cls._apply(changes)
+        cls._persist(changes)
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        if ENGINE is not None:
+            ENGINE.remove(self)
+            return
+        self.__class__._refresh()
+        with self.__class__._memory_lock():
+            removed = DATA[s_class].get(self.id) is not None
+            if removed:
+                self.__class__._apply({self.id: None})
+        if removed:
+            self.__class__._persist({self.id: None})
+
+    @classmethod
+    def generation(cls) -> str:
+        """ Opaque value that changes whenever objects of the class are
+        saved or removed, to validate cached results
+
+        It is derived from the state of the shared files, the snapshot
+        signature and the journal offset, so every process that read
+        them returns the same value. Changes still pending in
+        write-behind mode are only seen by this process, which then adds
+        its own counter.
+        """
+        if ENGINE is not None:
+            return str(ENGINE.generation(cls))
+        s_class = cls.__name__
+        cls._refresh()
+        snapshot, offset = FILE_STATES.get(s_class, (None, 0))
+        generation = "-".join("{:x}".format(n)
+                              for n in (snapshot or ()) + (offset,))
+        if FLUSHER is not None and FLUSHER.changes(cls):
+            generation += ".{}.{}".format(PROCESS_ID,
+                                          GENERATIONS.get(s_class, 0))
+        return generation
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        if ENGINE is not None:
+            return ENGINE.count(cls)
+        cls._refresh()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -118,14 +850,63 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        if ENGINE is not None:
+            return ENGINE.get(cls, id)
+        cls._refresh()
+        return cls._hydrate(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
-        """ Search all objects with matching attributes
+    def _candidates(cls, attributes: dict) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects that may match attributes: those of
+        the smallest index bucket among the indexed attributes, or all
+        objects when no indexed attribute is queried
         """
         s_class = cls.__name__
+        bucket = None
+        for k, v in attributes.items():
+            if k not in INDEXES[s_class]:
+                continue
+            index = INDEXES[s_class][k]
+            if index is None:
+                index = cls._build_index(k)
+            try:
+                ids = index.get(v, ())
+            except TypeError:
+                continue
+            if bucket is None or len(ids) < len(bucket):
+                bucket = ids
+        if bucket is not None:
+            for obj_id in list(bucket):
+                obj = cls._hydrate(obj_id)
+                # None when a reload swapped the objects meanwhile
+                if obj is not None:
+                    yield obj
+            return
+        for obj_id, obj in iter_items(DATA[s_class]):
+            obj = cls._hydrate(obj_id) if type(obj) is dict else obj
+            if obj is not None:
+                yield obj
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {}, limit: int = None,
+                    offset: int = 0,
+                    after: str = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects with matching attributes, building
+        and matching them only as the iteration goes
+
+        Arguments:
+        limit -- Maximum number of objects.
+        offset -- Number of matching objects skipped first.
+        after -- Id of an object: the iteration resumes after it, like
+          a cursor, and is empty when no such object matches. Matching
+          objects up to it are still walked through, see paginate().
+        """
+        if ENGINE is not None:
+            yield from ENGINE.iter_search(cls, attributes, limit, offset,
+                                          after)
+            return
+        cls._refresh()
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -133,5 +914,26 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        matches = filter(_search, cls._candidates(attributes))
+        yield from paginate(matches, limit, offset, after)
+
+    @classmethod
+    def iter_all(cls, limit: int = None, offset: int = 0,
+                 after: str = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects, see iter_search()
+        """
+        return cls.iter_search({}, limit, offset, after)
+
+    @classmethod
+    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        return list(cls.iter_search(attributes))
+
+    @classmethod
+    def query(cls) -> "Query":
+        """ Query on the objects of the class, see models.query
+        """
+        from models.query import Query
+        return Query(cls)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+A binary snapshot holds the serialized objects of a model class:
+
+    header      magic, version, number of fields, records and strings,
+                and the positions of the sections below
+    fields      one string number per field, the first one being "id"
+    rows        one fixed-size row per record, in insertion order, made
+                of one string number per field (MISSING when absent)
+    index       record numbers sorted by id, for binary searches
+    strings     offsets of the strings, then the strings themselves:
+                a kind byte (s: text, j: JSON value) and UTF-8 bytes
+
+Every string is stored once, so repeated values such as timestamps take
+no extra room. The file is memory-mapped and records are only decoded
+when they are accessed.
+"""
+import json
+import mmap
+import struct
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from typing import Iterator, Mapping, Tuple
+
+from models.file_store import atomic_open
+
+MAGIC = b"BSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIIQQQ")
+MISSING = 0xFFFFFFFF
+
+
+def _encode(value) -> bytes:
+    """ Encoded string of a value
+    """
+    if type(value) is str:
+        return b"s" + value.encode()
+    return b"j" + json.dumps(value).encode()
+
+
+def _decode(data: bytes):
+    """ Value of an encoded string
+    """
+    if data[:1] == b"s":
+        return data[1:].decode()
+    return json.loads(data[1:])
+
+
+def write_snapshot(file_path: str, records: Mapping[str, dict]):
+    """ Write serialized objects, keyed by id, as a binary snapshot
+
+    The records of a SnapshotDict that were not changed are copied from
+    its snapshot without being decoded.
+    """
+    if isinstance(records, SnapshotDict):
+        rows = list(records.encoded_values())
+    else:
+        rows = [{key: _encode(value) for key, value in record.items()}
+                for record in records.values()]
+    strings = {}
+
+    def intern(data: bytes) -> int:
+        number = strings.get(data)
+        if number is None:
+            number = strings[data] = len(strings)
+        return number
+
+    fields = ["id"]
+    seen = {"id"}
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                fields.append(key)
+    field_numbers = [intern(_encode(f)) for f in fields]
+    row_struct = struct.Struct("<{}I".format(len(fields)))
+    table = bytearray()
+    for row in rows:
+        table += row_struct.pack(*(intern(row[f]) if f in row
+                                   else MISSING for f in fields))
+    index = sorted(range(len(rows)), key=lambda i: rows[i]["id"])
+
+    rows_pos = HEADER.size + 4 * len(fields)
+    index_pos = rows_pos + len(table)
+    strings_pos = index_pos + 4 * len(index)
+    with atomic_open(file_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(fields), len(rows),
+                            len(strings), rows_pos, index_pos,
+                            strings_pos))
+        f.write(struct.pack("<{}I".format(len(fields)), *field_numbers))
+        f.write(table)
+        f.write(struct.pack("<{}I".format(len(index)), *index))
+        offsets = [0]
+        for data in strings:
+            offsets.append(offsets[-1] + len(data))
+        f.write(struct.pack("<{}Q".format(len(offsets)), *offsets))
+        f.write(b"".join(strings))
+
+
+class BinarySnapshot():
+    """ Read-only, memory-mapped binary snapshot
+    """
+
+    def __init__(self, file_path: str):
+        """ Map the snapshot file_path
+        """
+        with open(file_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self._n_fields, self._n_records, n_strings,
+         self._rows_pos, self._index_pos,
+         strings_pos) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a binary snapshot".format(file_path))
+        self._row = struct.Struct("<{}I".format(self._n_fields))
+        self._offsets_pos = strings_pos
+        self._blob_pos = strings_pos + 8 * (n_strings + 1)
+        self._fields = tuple(
+            self._string(n) for n in struct.unpack_from(
+                "<{}I".format(self._n_fields), self._map, HEADER.size))
+
+    def __len__(self) -> int:
+        """ Number of records
+        """
+        return self._n_records
+
+    def _raw(self, number: int) -> bytes:
+        """ Encoded string number
+        """
+        start, end = struct.unpack_from(
+            "<QQ", self._map, self._offsets_pos + 8 * number)
+        return self._map[self._blob_pos + start:self._blob_pos + end]
+
+    def _string(self, number: int):
+        """ Value of the string number
+        """
+        return _decode(self._raw(number))
+
+    def _id_number(self, position: int) -> int:
+        """ String number of the id of the record at position
+        """
+        return struct.unpack_from(
+            "<I", self._map, self._rows_pos + position * self._row.size)[0]
+
+    def numbers(self, position: int) -> tuple:
+        """ String numbers of the fields of the record at position
+        """
+        return self._row.unpack_from(
+            self._map, self._rows_pos + position * self._row.size)
+
+    def record(self, position: int) -> dict:
+        """ Serialized object at position
+        """
+        return {field: self._string(n)
+                for field, n in zip(self._fields, self.numbers(position))
+                if n != MISSING}
+
+    def encoded_record(self, position: int) -> dict:
+        """ Encoded fields of the record at position, left undecoded
+        """
+        return {field: self._raw(n)
+                for field, n in zip(self._fields, self.numbers(position))
+                if n != MISSING}
+
+    def column(self, field: str) -> Iterator[Tuple[int, object]]:
+        """ Positions of the records, in insertion order, with the value
+        of their field (None when absent)
+        """
+        if field not in self._fields:
+            for position in range(self._n_records):
+                yield position, None
+            return
+        offset = self._rows_pos + 4 * self._fields.index(field)
+        size = self._row.size
+        for position in range(self._n_records):
+            n = struct.unpack_from("<I", self._map, offset + position * size)
+            yield position, None if n[0] == MISSING else self._string(n[0])
+
+    def find(self, obj_id: str) -> int:
+        """ Position of the record of obj_id, or None
+        """
+        if type(obj_id) is not str:
+            return None
+        key = _encode(obj_id)
+        low, high = 0, self._n_records
+        while low < high:
+            middle = (low + high) // 2
+            position = struct.unpack_from(
+                "<I", self._map, self._index_pos + 4 * middle)[0]
+            data = self._raw(self._id_number(position))
+            if data == key:
+                return position
+            if data < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def ids(self) -> Iterator[Tuple[str, int]]:
+        """ Ids of the records, with their positions, in insertion order
+        """
+        for position in range(self._n_records):
+            yield self._string(self._id_number(position)), position
+
+
+def _attribute(value, attr: str):
+    """ attr of an object or of its serialized form
+    """
+    if type(value) is dict:
+        return value.get(attr)
+    return getattr(value, attr, None)
+
+
+class SnapshotDict(MutableMapping):
+    """ Dictionary of serialized objects backed by a binary snapshot
+
+    Records are decoded from the snapshot when read; objects set or
+    deleted afterwards are kept in memory on top of it.
+    """
+
+    def __init__(self, snapshot: BinarySnapshot):
+        """ Initialize a dictionary on snapshot
+        """
+        self._snapshot = snapshot
+        self._changed = {}
+        self._added = {}
+        self._removed = set()
+
+    def __getitem__(self, key: str):
+        """ Object or serialized object stored under key
+        """
+        if key in self._changed:
+            return self._changed[key]
+        if key not in self._removed:
+            position = self._snapshot.find(key)
+            if position is not None:
+                return self._snapshot.record(position)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        """ Store value under key
+        """
+        if key not in self._changed and self._snapshot.find(key) is None:
+            self._added[key] = None
+        self._removed.discard(key)
+        self._changed[key] = value
+
+    def __delitem__(self, key: str):
+        """ Delete the value stored under key
+        """
+        if key in self._added:
+            del self._added[key]
+        elif key in self._removed or self._snapshot.find(key) is None:
+            raise KeyError(key)
+        else:
+            self._removed.add(key)
+        self._changed.pop(key, None)
+
+    def _items(self) -> Iterator[tuple]:
+        """ Keys and values in insertion order
+        """
+        for key, position in self._snapshot.ids():
+            if key in self._changed:
+                yield key, self._changed[key]
+            elif key not in self._removed:
+                yield key, self._snapshot.record(position)
+        for key in list(self._added):
+            yield key, self._changed[key]
+
+    def column(self, attr: str) -> Iterator[tuple]:
+        """ Keys in insertion order, with the attr value of their record,
+        decoding only that field of the records in the snapshot
+        """
+        ids = self._snapshot.ids()
+        for (key, _), (position, value) in zip(
+                ids, self._snapshot.column(attr)):
+            if key in self._changed:
+                yield key, _attribute(self._changed[key], attr)
+            elif key not in self._removed:
+                yield key, value
+        for key in list(self._added):
+            yield key, _attribute(self._changed[key], attr)
+
+    def encoded_values(self) -> Iterator[dict]:
+        """ Records in insertion order with encoded fields, left
+        undecoded for those of the snapshot; values set in memory must
+        be serialized objects
+        """
+        for key, position in self._snapshot.ids():
+            if key in self._changed:
+                yield {k: _encode(v) for k, v in self._changed[key].items()}
+            elif key not in self._removed:
+                yield self._snapshot.encoded_record(position)
+        for key in list(self._added):
+            yield {k: _encode(v) for k, v in self._changed[key].items()}
+
+    def with_values(self, func) -> "SnapshotDict":
+        """ Copy sharing the snapshot, with func applied to the values
+        set in memory
+        """
+        copy = SnapshotDict(self._snapshot)
+        copy._changed = {k: func(v) for k, v in self._changed.items()}
+        copy._added = dict(self._added)
+        copy._removed = set(self._removed)
+        return copy
+
+    def __iter__(self) -> Iterator[str]:
+        """ Keys in insertion order
+        """
+        for key, position in self._snapshot.ids():
+            if key not in self._removed:
+                yield key
+        yield from list(self._added)
+
+    def __len__(self) -> int:
+        """ Number of stored values
+        """
+        return len(self._snapshot) - len(self._removed) + len(self._added)
+
+    def items(self) -> ItemsView:
+        """ Keys and values, decoding each record once
+        """
+        return _Items(self)
+
+    def values(self) -> ValuesView:
+        """ Values, decoding each record once
+        """
+        return _Values(self)
+
+
+class _Items(ItemsView):
+    """ Items view of a SnapshotDict
+    """
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self._mapping._items()
+
+
+class _Values(ValuesView):
+    """ Values view of a SnapshotDict
+    """
+
+    def __iter__(self) -> Iterator:
+        return (value for _, value in self._mapping._items())
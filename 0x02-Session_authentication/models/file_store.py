@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+""" File store module
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # advisory locks are not available on this platform
+    fcntl = None
+
+
+class FileLock():
+    """ Advisory lock shared by every process opening the same path
+
+    hold() is reentrant within a process: threads of the process take
+    turns, and a nested hold() reuses the lock already taken, upgrading
+    it when an exclusive lock is asked inside a shared one.
+    """
+
+    def __init__(self, path: str):
+        """ Initialize a lock on the file path, created when needed
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+        self._exclusive = False
+
+    def _flock(self, exclusive: bool):
+        """ Take the lock of the file, waiting for other processes
+        """
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive
+                        else fcntl.LOCK_SH)
+        self._exclusive = exclusive
+
+    @contextmanager
+    def hold(self, exclusive: bool = True) -> Iterator[None]:
+        """ Hold the lock, exclusive or shared, for the block
+        """
+        with self._lock:
+            if self._depth == 0:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._flock(exclusive)
+            elif exclusive and not self._exclusive:
+                self._flock(True)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # closing the file releases the lock
+                    os.close(self._fd)
+                    self._fd = None
+                    self._exclusive = False
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w") -> Iterator[IO]:
+    """ Open a temporary file that replaces path once the block succeeds
+
+    The file is flushed and fsynced before being renamed over path, so
+    readers see either the previous or the new content, never a part.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".{}.".format(os.path.basename(path)), dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode)
+        except OSError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+
+
+def _fsync_directory(directory: str):
+    """ Make a rename in directory durable, where the platform allows it
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
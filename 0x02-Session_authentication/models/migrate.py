@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+""" Migration of stored objects between storages: JSON snapshots
+(.db_<class>.json), binary snapshots (.db_<class>.bin) and SQLite
+
+Usage:
+    python3 -m models.migrate SOURCE TARGET [--db .db.sqlite3] [Class ...]
+
+where SOURCE and TARGET are json, binary or sqlite.
+"""
+import argparse
+from os import getenv
+from typing import List
+
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+from models.user_session import UserSession
+
+CLASSES = {cls.__name__: cls for cls in (User, UserSession)}
+STORAGES = ("json", "binary", "sqlite")
+
+
+def migrate(source: str, target: str, db_path: str,
+            classes: List[type]) -> dict:
+    """ Copy every object of classes from the source storage to the
+    target storage, replacing what the target held
+
+    Returns:
+    The number of objects copied, keyed by class name.
+    """
+    storage = SQLiteStorage(db_path)
+    copied = {}
+    for cls in classes:
+        if source == "sqlite":
+            records = storage.export_records(cls)
+        else:
+            records = cls._read_records(source)[0]
+        if target == "sqlite":
+            storage.import_records(cls, records, replace=True)
+        else:
+            cls._write_records(records, target)
+        copied[cls.__name__] = len(records)
+    return copied
+
+
+def main():
+    """ Command line entry point
+    """
+    parser = argparse.ArgumentParser(
+        description="Copy stored objects between storages.")
+    parser.add_argument("source", choices=STORAGES)
+    parser.add_argument("target", choices=STORAGES)
+    parser.add_argument("--db", default=getenv("MODELS_SQLITE_PATH",
+                                               ".db.sqlite3"),
+                        help="SQLite database file")
+    parser.add_argument("classes", nargs="*", metavar="Class",
+                        help="classes to copy (default: {})".format(
+                            " ".join(CLASSES)))
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("source and target are the same storage")
+    unknown = set(args.classes) - set(CLASSES)
+    if unknown:
+        parser.error("unknown classes: {}".format(", ".join(unknown)))
+    classes = [CLASSES[name] for name in args.classes or CLASSES]
+    for name, count in migrate(args.source, args.target, args.db,
+                               classes).items():
+        print("{}: {} objects".format(name, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+""" Query module
+
+A Query selects objects of a model class with equality, prefix and
+range conditions, optionally ordered and limited:
+
+    an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    User.query().range("created_at", start=an_hour_ago) \
+        .order_by("created_at", descending=True).limit(10).all()
+
+It is compiled into the plan reading the fewest candidates: a hash index
+(INDEXED_ATTRIBUTES) for an equality, a sorted index (SORTED_ATTRIBUTES)
+for a range or a prefix, which also yields the objects in order, or
+every object. explain() describes the chosen plan. With the SQLite
+storage, conditions on indexed columns are compiled to SQL instead.
+
+Ordered queries are paginated with after(), a cursor resuming after a
+given object, which an ordered plan seeks to directly:
+
+    page = User.query().order_by("email").limit(20).all()
+    User.query().order_by("email").after(page[-1].email, page[-1].id) \
+        .limit(20).all()
+"""
+from itertools import islice
+from typing import Iterator, List, TypeVar
+
+from models import base
+from models.sorted_index import SortedIndex, prefix_bounds
+
+
+class Query():
+    """ Query on the objects of a model class
+
+    Conditions are added with where(), prefix() and range(), which
+    return the query so that calls can be chained.
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize a query matching every object of cls
+        """
+        self.cls = cls
+        self._conditions = []
+        self._order = None
+        self._limit = None
+        self._offset = 0
+        self._after = None
+
+    def where(self, **attributes: dict) -> "Query":
+        """ Match the objects whose attributes equal the given values
+        """
+        for attr, value in attributes.items():
+            self._conditions.append(
+                ("eq", attr, self.cls._raw_value(attr, value)))
+        return self
+
+    def prefix(self, attr: str, prefix: str) -> "Query":
+        """ Match the objects whose attr is a string starting with prefix
+        """
+        self._conditions.append(("prefix", attr, prefix))
+        return self
+
+    def range(self, attr: str, start=None, end=None) -> "Query":
+        """ Match the objects with start <= attr < end; a missing bound
+        is not checked
+        """
+        self._conditions.append(
+            ("range", attr, (self.cls._raw_value(attr, start),
+                             self.cls._raw_value(attr, end))))
+        return self
+
+    def order_by(self, attr: str, descending: bool = False) -> "Query":
+        """ Order the objects by attr, None values last and ties by id
+        """
+        self._order = (attr, descending)
+        return self
+
+    def limit(self, limit: int) -> "Query":
+        """ Return at most limit objects
+        """
+        self._limit = limit
+        return self
+
+    def offset(self, offset: int) -> "Query":
+        """ Skip the first offset objects
+        """
+        self._offset = offset
+        return self
+
+    def after(self, value, obj_id: str) -> "Query":
+        """ Resume after the object with this value of the order_by()
+        attribute and this id
+        """
+        self._after = (value, obj_id)
+        self._after_key_cache = (None, None)
+        return self
+
+    def _after_key(self) -> tuple:
+        """ (value, id) of the after() object, its value parsed, or None
+        """
+        if self._after is None or self._order is None:
+            return None
+        value, obj_id = self._after
+        if self._after_key_cache[0] != (self._order[0], value):
+            self._after_key_cache = (
+                (self._order[0], value),
+                (self.cls._raw_value(self._order[0], value), obj_id))
+        return self._after_key_cache[1]
+
+    def _follows(self, obj: TypeVar('Base')) -> bool:
+        """ Whether obj comes after the after() object in the query order
+        """
+        after = self._after_key()
+        if after is None:
+            return True
+        attr, descending = self._order
+        value = getattr(obj, attr, None)
+        if (value is None) != (after[0] is None):
+            # None values come last
+            return value is None
+        try:
+            if value is None:
+                return obj.id < after[1] if descending else obj.id > after[1]
+            key = (value, obj.id)
+            return key < after if descending else key > after
+        except TypeError:
+            return False
+
+    @staticmethod
+    def _check(kind: str, value, argument) -> bool:
+        """ Whether value meets a condition
+        """
+        if kind == "eq":
+            return value == argument
+        if kind == "prefix":
+            return type(value) is str and value.startswith(argument)
+        if value is None:
+            return False
+        start, end = argument
+        try:
+            return (start is None or value >= start) and \
+                (end is None or value < end)
+        except TypeError:
+            return False
+
+    def _matches(self, obj: TypeVar('Base')) -> bool:
+        """ Whether obj meets every condition
+        """
+        return self._follows(obj) and \
+            all(self._check(kind, getattr(obj, attr, None), argument)
+                for kind, attr, argument in self._conditions)
+
+    def _bounds(self, attr: str) -> tuple:
+        """ Narrowest (start, end) range of attr set by the conditions,
+        or None when no range or prefix condition is on attr
+        """
+        bounds = None
+        for kind, cond_attr, argument in self._conditions:
+            if cond_attr != attr or kind == "eq":
+                continue
+            start, end = prefix_bounds(argument) if kind == "prefix" \
+                else argument
+            if bounds is None:
+                bounds = (start, end)
+                continue
+            if start is not None:
+                bounds = (start if bounds[0] is None
+                          else max(bounds[0], start), bounds[1])
+            if end is not None:
+                bounds = (bounds[0], end if bounds[1] is None
+                          else min(bounds[1], end))
+        return bounds
+
+    def _plans(self) -> List[dict]:
+        """ Every plan able to answer the query, with its estimated
+        number of candidates and cost
+        """
+        cls = self.cls
+        s_class = cls.__name__
+        ordered_attr = self._order[0] if self._order else None
+        total = len(base.DATA[s_class])
+        plans = []
+        for kind, attr, value in self._conditions:
+            if kind != "eq" or attr not in base.INDEXES[s_class]:
+                continue
+            index = base.INDEXES[s_class][attr]
+            if index is None:
+                index = cls._build_index(attr)
+            try:
+                ids = index.get(value, {})
+            except TypeError:
+                continue
+            plans.append({"access": "hash index", "attribute": attr,
+                          "rows": len(ids), "ordered": False,
+                          "ids": lambda ids=ids: list(ids)})
+        for attr in cls.SORTED_ATTRIBUTES:
+            try:
+                bounds = self._bounds(attr)
+            except TypeError:
+                continue
+            if bounds is None and attr != ordered_attr:
+                continue
+            index = cls._sorted_index(attr)
+            start, end = bounds or (None, None)
+            if bounds is None and len(index) < total:
+                # objects with a None value are not indexed: they follow
+                # the indexed ones, found by a scan once these are read
+                plans.append({"access": "sorted index and scan",
+                              "attribute": attr, "rows": total,
+                              "ordered": True,
+                              "ids": lambda attr=attr, index=index:
+                              self._index_ids(attr, index)})
+                continue
+            plans.append({"access": "sorted index", "attribute": attr,
+                          "rows": index.count(start, end),
+                          "range": [start, end],
+                          "ordered": attr == ordered_attr,
+                          "ids": lambda attr=attr, index=index, start=start,
+                          end=end: self._index_ids(attr, index, start, end)})
+        plans.append({"access": "scan", "rows": total, "ordered": False,
+                      "ids": lambda: self._scan_ids()})
+        for plan in plans:
+            rows = plan["rows"]
+            if plan["ordered"] and self._limit is not None:
+                plan["cost"] = min(rows, self._offset + self._limit)
+            elif ordered_attr is not None and not plan["ordered"]:
+                # candidates are sorted after being filtered
+                plan["cost"] = 2 * rows
+            else:
+                plan["cost"] = rows
+        return plans
+
+    def _index_ids(self, attr: str, index: SortedIndex, start=None,
+                   end=None) -> Iterator[str]:
+        """ Ids of the objects of index, the sorted index of attr, with
+        start <= value < end, in the query order; when the query orders
+        by attr, the iteration seeks to the after() object, and without
+        a range it goes on with the objects not in index, by id
+        """
+        descending = bool(self._order and self._order[1])
+        after = self._after_key()
+        if self._order is None or self._order[0] != attr:
+            after = None
+        if after is None or after[0] is not None:
+            yield from index.range(start, end, descending, after)
+        if start is None and end is None and len(index) < \
+                len(base.DATA[self.cls.__name__]):
+            ids = [obj_id for obj_id in self._scan_ids()
+                   if obj_id not in index]
+            yield from sorted(ids, reverse=descending)
+
+    def _scan_ids(self) -> Iterator[str]:
+        """ Ids of every stored object
+        """
+        return (obj_id for obj_id, _ in
+                base.iter_items(base.DATA[self.cls.__name__]))
+
+    def _plan(self) -> dict:
+        """ Cheapest plan, the earliest one on a tie
+        """
+        return min(self._plans(), key=lambda plan: plan["cost"])
+
+    def _sorted(self, objs: Iterator[TypeVar('Base')]) -> list:
+        """ objs in the query order, None values last
+        """
+        attr, descending = self._order
+        objs = list(objs)
+        missing = [obj for obj in objs if getattr(obj, attr, None) is None]
+        present = [obj for obj in objs
+                   if getattr(obj, attr, None) is not None]
+        present.sort(key=lambda obj: (getattr(obj, attr), obj.id),
+                     reverse=descending)
+        missing.sort(key=lambda obj: obj.id, reverse=descending)
+        return present + missing
+
+    def _compile(self) -> tuple:
+        """ SQL query of the conditions the SQLite storage can answer,
+        with its parameters and the conditions left to check on objects
+        """
+        columns = ("id",) + base.ENGINE._columns(self.cls)
+        conditions, rest = [], []
+        for kind, attr, argument in self._conditions:
+            if attr not in columns:
+                rest.append((kind, attr, argument))
+                continue
+            if kind == "eq":
+                if type(argument) not in (str, int, float, type(None)) and \
+                        not hasattr(argument, "isoformat"):
+                    rest.append((kind, attr, argument))
+                    continue
+                conditions.append((attr, "=", self._column_value(argument)))
+                continue
+            start, end = prefix_bounds(argument) if kind == "prefix" \
+                else argument
+            if start is not None:
+                conditions.append((attr, ">=", self._column_value(start)))
+            if end is not None:
+                conditions.append((attr, "<", self._column_value(end)))
+        order = self._order if self._order and self._order[0] in columns \
+            else None
+        push = not rest and (self._order is None or order is not None)
+        after = self._after_key() if push else None
+        if after is not None:
+            after = (self._column_value(after[0]), after[1])
+        sql, params = base.ENGINE.select(
+            self.cls, conditions, order,
+            self._limit if push else None, self._offset if push else 0,
+            after)
+        return sql, params, rest, push
+
+    @staticmethod
+    def _column_value(value):
+        """ Value as stored in a column of the SQLite storage
+        """
+        if hasattr(value, "isoformat"):
+            return base.format_timestamp(value)
+        return value
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the matching objects
+        """
+        stop = None if self._limit is None else self._offset + self._limit
+        if base.ENGINE is not None:
+            sql, params, rest, push = self._compile()
+            objs = base.ENGINE.query(self.cls, sql, params)
+            if push:
+                yield from objs
+                return
+            objs = filter(self._matches, objs)
+            if self._order is not None:
+                objs = self._sorted(objs)
+            yield from islice(objs, self._offset, stop)
+            return
+        self.cls._refresh()
+        plan = self._plan()
+        objs = (self.cls._hydrate(obj_id) for obj_id in plan["ids"]())
+        objs = (obj for obj in objs if obj is not None and self._matches(obj))
+        if self._order is not None and not plan["ordered"]:
+            objs = self._sorted(objs)
+        yield from islice(objs, self._offset, stop)
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> TypeVar('Base'):
+        """ First matching object, or None
+        """
+        return next(iter(self), None)
+
+    def explain(self) -> dict:
+        """ Description of the plan the query runs
+        """
+        description = {
+            "class": self.cls.__name__,
+            "conditions": [[kind, attr, str(argument)]
+                           for kind, attr, argument in self._conditions],
+            "order": list(self._order) if self._order else None,
+            "limit": self._limit,
+            "offset": self._offset,
+            "after": [str(v) for v in self._after] if self._after else None,
+        }
+        if base.ENGINE is not None:
+            sql, params, rest, push = self._compile()
+            description.update({
+                "access": "sqlite",
+                "sql": sql,
+                "params": params,
+                "steps": base.ENGINE.explain(sql, params),
+                "filtered_in_python": [[kind, attr, str(argument)]
+                                       for kind, attr, argument in rest],
+                "sorted_in_python": not push and self._order is not None,
+            })
+            return description
+        self.cls._refresh()
+        plans = self._plans()
+        chosen = min(plans, key=lambda plan: plan["cost"])
+
+        def summary(plan):
+            return {k: (str(v) if k == "range" else v)
+                    for k, v in plan.items() if k != "ids"}
+
+        description.update(summary(chosen))
+        description["sorted_after_filter"] = \
+            self._order is not None and not chosen["ordered"]
+        description["considered"] = [summary(plan) for plan in plans]
+        return description
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+""" Sorted index module
+"""
+from bisect import bisect_left, bisect_right, insort
+import threading
+from typing import Iterable, Iterator, Tuple
+
+RANGE_CHUNK = 256
+
+
+class SortedIndex():
+    """ Values of an attribute kept in order with the ids of their
+    objects, for range and prefix lookups
+
+    None and values that cannot be compared with the others are not
+    indexed: no range or prefix matches them anyway. add() and remove()
+    are atomic, so threads can change the index while others read it.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, object]] = ()):
+        """ Initialize an index of (object id, value) items
+        """
+        self._keys = []
+        self._values = {}
+        self._lock = threading.Lock()
+        for obj_id, value in items:
+            if value is not None:
+                self._keys.append((value, obj_id))
+                self._values[obj_id] = value
+        try:
+            self._keys.sort()
+        except TypeError:
+            keys, self._keys, self._values = self._keys, [], {}
+            for value, obj_id in keys:
+                self.add(obj_id, value)
+
+    def __len__(self) -> int:
+        """ Number of indexed objects
+        """
+        return len(self._keys)
+
+    def __contains__(self, obj_id: str) -> bool:
+        """ Whether the value of an object is indexed
+        """
+        return obj_id in self._values
+
+    def add(self, obj_id: str, value):
+        """ Index the value of an object, replacing its previous one
+        """
+        with self._lock:
+            self._remove(obj_id)
+            if value is None:
+                return
+            try:
+                insort(self._keys, (value, obj_id))
+            except TypeError:
+                return
+            self._values[obj_id] = value
+
+    def remove(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        with self._lock:
+            self._remove(obj_id)
+
+    def _remove(self, obj_id: str):
+        """ Remove an object from the index, the lock being held
+        """
+        if obj_id not in self._values:
+            return
+        key = (self._values.pop(obj_id), obj_id)
+        i = bisect_left(self._keys, key)
+        # only ever delete the entry of this object
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def _bounds(self, start=None, end=None) -> Tuple[int, int]:
+        """ Positions of the keys with start <= value < end
+        """
+        try:
+            low = 0 if start is None else bisect_left(self._keys, (start,))
+            high = len(self._keys) if end is None \
+                else bisect_left(self._keys, (end,))
+        except TypeError:
+            return 0, 0
+        return low, max(low, high)
+
+    def count(self, start=None, end=None) -> int:
+        """ Number of objects with start <= value < end
+        """
+        low, high = self._bounds(start, end)
+        return high - low
+
+    def range(self, start=None, end=None, reverse: bool = False,
+              after: tuple = None) -> Iterator[str]:
+        """ Ids of the objects with start <= value < end, by value
+
+        after -- (value, id) of an object: the iteration resumes after
+          it, like a cursor.
+
+        Keys are read RANGE_CHUNK at a time, each chunk being located
+        from the last key read, so a page only costs its own size and
+        changes made to the index meanwhile are tolerated.
+        """
+        while True:
+            low, high = self._bounds(start, end)
+            try:
+                if after is not None and reverse:
+                    high = min(high, bisect_left(self._keys, after))
+                elif after is not None:
+                    low = max(low, bisect_right(self._keys, after))
+            except TypeError:
+                return
+            if low >= high:
+                return
+            if reverse:
+                keys = self._keys[max(low, high - RANGE_CHUNK):high]
+                keys.reverse()
+            else:
+                keys = self._keys[low:min(high, low + RANGE_CHUNK)]
+            for _, obj_id in keys:
+                yield obj_id
+            after = keys[-1]
+
+
+def prefix_bounds(prefix: str) -> Tuple[str, str]:
+    """ Bounds (start, end) of the strings starting with prefix, end
+    being None when there is no upper bound
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return "", None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
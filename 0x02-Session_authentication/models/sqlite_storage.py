@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+"""
+import json
+import sqlite3
+import threading
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, TypeVar
+
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class SQLiteStorage():
+    """ Storage of model objects in a SQLite database
+
+    Each model class gets a table keyed by id, holding the serialized
+    object in a data column next to created_at, updated_at and one
+    indexed column per attribute of INDEXED_ATTRIBUTES, so lookups on
+    those attributes are answered by SQLite indexes. Every thread uses
+    its own connection.
+
+    The _generations table counts the changes made to each table, by
+    any process, for generation().
+    """
+
+    COLUMNS = ("created_at", "updated_at")
+
+    def __init__(self, db_path: str):
+        """ Initialize a storage on the database file db_path
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = conn
+        return conn
+
+    @staticmethod
+    def _columns(cls: type) -> tuple:
+        """ Queryable columns of the table of cls
+        """
+        indexed = tuple(a for a in cls.INDEXED_ATTRIBUTES
+                        if a not in SQLiteStorage.COLUMNS)
+        return SQLiteStorage.COLUMNS + indexed
+
+    def load(self, cls: type):
+        """ Create the table of cls and its indexes if needed
+        """
+        table = cls.__name__
+        columns = self._columns(cls)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS "{}" (id TEXT PRIMARY KEY, {}, '
+            'data TEXT NOT NULL)'.format(
+                table, ", ".join('"{}"'.format(c) for c in columns)))
+        for column in columns:
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS "ix_{0}_{1}" '
+                'ON "{0}" ("{1}")'.format(table, column))
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS "_generations" '
+            '(name TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+        self.connection.execute(
+            'INSERT OR IGNORE INTO "_generations" VALUES (?, 0)', (table,))
+        self._tables.add(table)
+
+    def _table(self, cls: type) -> str:
+        """ Name of the table of cls, created on first use
+        """
+        if cls.__name__ not in self._tables:
+            self.load(cls)
+        return cls.__name__
+
+    @staticmethod
+    def _value(value):
+        """ Column value of an attribute value
+        """
+        return value if type(value) in SCALAR_TYPES else json.dumps(value)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        record = obj.to_json(True)
+        columns = self._columns(cls)
+        values = [self._value(record.get(c)) for c in columns]
+        values.append(json.dumps(record))
+        assignments = ", ".join('"{}" = ?'.format(c)
+                                for c in columns + ("data",))
+        conn = self.connection
+        cursor = conn.execute(
+            'UPDATE "{}" SET {} WHERE id = ?'.format(table, assignments),
+            values + [obj.id])
+        if cursor.rowcount == 0:
+            conn.execute(
+                'INSERT INTO "{}" (id, {}, data) VALUES (?, {}, ?)'.format(
+                    table, ", ".join('"{}"'.format(c) for c in columns),
+                    ", ".join("?" for _ in columns)),
+                [obj.id] + values)
+        self._bump(table)
+
+    def save_all(self, objs: Iterable[TypeVar('Base')]):
+        """ Insert or update objects in a single transaction
+        """
+        conn = self.connection
+        conn.execute("BEGIN")
+        try:
+            for obj in objs:
+                self.save(obj)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        table = self._table(obj.__class__)
+        self.connection.execute(
+            'DELETE FROM "{}" WHERE id = ?'.format(table), (obj.id,))
+        self._bump(table)
+
+    def _bump(self, table: str):
+        """ Count a change to table, after it is made so that a reader
+        never sees the new generation with the previous data
+        """
+        self.connection.execute(
+            'UPDATE "_generations" SET generation = generation + 1 '
+            'WHERE name = ?', (table,))
+
+    def generation(self, cls: type) -> int:
+        """ Number of changes made to the table of cls
+        """
+        table = self._table(cls)
+        return self.connection.execute(
+            'SELECT generation FROM "_generations" WHERE name = ?',
+            (table,)).fetchone()[0]
+
+    def count(self, cls: type) -> int:
+        """ Number of stored objects of cls
+        """
+        table = self._table(cls)
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Object of cls stored under obj_id, or None
+        """
+        table = self._table(cls)
+        row = self.connection.execute(
+            'SELECT data FROM "{}" WHERE id = ?'.format(table),
+            (obj_id,)).fetchone()
+        return cls(**json.loads(row[0])) if row else None
+
+    def iter_search(self, cls: type, attributes: dict = {},
+                    limit: int = None, offset: int = 0,
+                    after: str = None) -> Iterator[TypeVar('Base')]:
+        """ Objects of cls matching attributes, in insertion order,
+        paginated like Base.iter_search()
+
+        Scalar values of id and indexed attributes are matched by SQLite;
+        the other attributes are compared on the built objects.
+        """
+        table = self._table(cls)
+        columns = ("id",) + self._columns(cls)
+        where, params, rest = [], [], {}
+        for k, v in attributes.items():
+            if k in columns and type(v) in (str, int, float, type(None)):
+                if v is None:
+                    where.append('"{}" IS NULL'.format(k))
+                else:
+                    where.append('"{}" = ?'.format(k))
+                    params.append(v)
+            else:
+                rest[k] = v
+
+        def matches(obj):
+            return all(getattr(obj, k) == v for k, v in rest.items())
+
+        conditions = list(where)
+        if after is not None:
+            after_obj = self.get(cls, after)
+            if after_obj is None or not matches(after_obj):
+                return
+            conditions.append('rowid > (SELECT rowid FROM "{}" WHERE {})'
+                              .format(table, " AND ".join(where + ["id = ?"])))
+            params = params + params + [after]
+        sql = 'SELECT data FROM "{}"'.format(table)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rowid"
+        if not rest and (limit is not None or offset):
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset]
+        objs = (cls(**json.loads(row[0]))
+                for row in self.connection.execute(sql, params))
+        if rest:
+            stop = None if limit is None else offset + limit
+            objs = islice(filter(matches, objs), offset, stop)
+        yield from objs
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ List of the objects of cls matching attributes
+        """
+        return list(self.iter_search(cls, attributes))
+
+    def select(self, cls: type, conditions: List[tuple],
+               order: tuple = None, limit: int = None,
+               offset: int = 0, after: tuple = None) -> Tuple[str, list]:
+        """ SQL query, and its parameters, of the objects of cls matching
+        conditions on the columns of its table
+
+        Arguments:
+        conditions -- (column, operator, value) triples, the operator
+          being one of =, >= or <.
+        order -- (column, descending) to order by, None values last.
+        after -- (column value, id) of an object: only the objects
+          following it in order are selected.
+        """
+        table = self._table(cls)
+        where, params = [], []
+        for column, op, value in conditions:
+            if value is None and op == "=":
+                where.append('"{}" IS NULL'.format(column))
+            else:
+                where.append('"{}" {} ?'.format(column, op))
+                params.append(value)
+        if order is not None and after is not None:
+            column, op = order[0], "<" if order[1] else ">"
+            if after[0] is None:
+                where.append('"{}" IS NULL AND id {} ?'.format(column, op))
+                params.append(after[1])
+            else:
+                where.append('("{0}" {1} ? OR ("{0}" = ? AND id {1} ?) OR '
+                             '"{0}" IS NULL)'.format(column, op))
+                params += [after[0], after[0], after[1]]
+        sql = 'SELECT data FROM "{}"'.format(table)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if order is None:
+            sql += " ORDER BY rowid"
+        else:
+            direction = " DESC" if order[1] else ""
+            sql += ' ORDER BY "{0}" IS NULL, "{0}"{1}, id{1}'.format(
+                order[0], direction)
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+        return sql, params
+
+    def query(self, cls: type, sql: str,
+              params: list) -> Iterator[TypeVar('Base')]:
+        """ Objects of cls selected by a select() query
+        """
+        for row in self.connection.execute(sql, params):
+            yield cls(**json.loads(row[0]))
+
+    def explain(self, sql: str, params: list) -> List[str]:
+        """ Steps SQLite plans for a query
+        """
+        rows = self.connection.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in rows]
+
+    def export_records(self, cls: type) -> dict:
+        """ Serialized objects of cls, keyed by id
+        """
+        table = self._table(cls)
+        rows = self.connection.execute(
+            'SELECT id, data FROM "{}" ORDER BY rowid'.format(table))
+        return {obj_id: json.loads(data) for obj_id, data in rows}
+
+    def import_records(self, cls: type, records: dict,
+                       replace: bool = False):
+        """ Store serialized objects of cls in a single transaction,
+        after deleting every stored object of cls when replace is True
+        """
+        table = self._table(cls)
+        conn = self.connection
+        conn.execute("BEGIN")
+        try:
+            if replace:
+                conn.execute('DELETE FROM "{}"'.format(table))
+                self._bump(table)
+            for record in records.values():
+                self.save(cls(**record))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -10,6 +10,9 @@ class UserSession(Base):
     """ UserSession class.
     """
 
+    __slots__ = ("user_id", "session_id")
+    INDEXED_ATTRIBUTES = ("user_id", "session_id")
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Constructor.
         """
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" Write-behind module
+"""
+import atexit
+import logging
+import signal
+import threading
+from typing import Dict
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WriteBehindFlusher():
+    """ Debounced writer of model changes
+
+    Changes are recorded as {object id: saved object, or None when
+    removed} per model class and written by a background thread, at most
+    once per interval seconds or as soon as max_dirty objects are
+    pending. Pending changes are also written by flush(), at interpreter
+    exit and on SIGTERM. A failed write is logged and retried after the
+    interval.
+    """
+
+    def __init__(self, interval: float, max_dirty: int = 1000):
+        """ Initialize a flusher
+        """
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._dirty = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.RLock()
+        self._local = threading.local()
+        self._exit = None
+        self._thread = None
+        atexit.register(self.flush)
+        self._install_signal_handler(signal.SIGTERM)
+
+    def _install_signal_handler(self, signum: int):
+        """ Flush pending changes before the signal terminates the process
+        """
+        try:
+            previous = signal.getsignal(signum)
+        except ValueError:
+            return
+
+        def terminate(frame):
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        def handler(signum, frame):
+            if getattr(self._local, "depth", 0):
+                # the signal interrupted a flush of this thread: let it
+                # finish, then terminate
+                self._exit = lambda: terminate(frame)
+                return
+            self.flush()
+            terminate(frame)
+
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            # signal handlers can only be set from the main thread
+            pass
+
+    def pending(self) -> int:
+        """ Number of objects waiting to be written
+        """
+        with self._cond:
+            return sum(len(changes) for changes in self._dirty.values())
+
+    def changes(self, cls: type) -> dict:
+        """ Changes of objects of cls waiting to be written
+        """
+        with self._cond:
+            return dict(self._dirty.get(cls, {}))
+
+    def mark(self, cls: type, changes: Dict[str, object]):
+        """ Record changes of objects of cls to be written later
+        """
+        with self._cond:
+            self._dirty.setdefault(cls, {}).update(changes)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        """ Background loop writing changes once per interval, or earlier
+        when too many objects are pending
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._dirty)
+                self._cond.wait_for(
+                    lambda: sum(len(c) for c in self._dirty.values())
+                    >= self.max_dirty, self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # changes were put back, the next round retries them
+                LOGGER.exception("Write-behind flush failed, retrying in "
+                                 "%s seconds", self.interval)
+                with self._cond:
+                    self._cond.wait(self.interval)
+
+    def flush(self):
+        """ Write every pending change now
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        try:
+            with self._flush_lock:
+                with self._cond:
+                    dirty, self._dirty = self._dirty, {}
+                items = list(dirty.items())
+                for i, (cls, changes) in enumerate(items):
+                    try:
+                        cls._write(changes)
+                    except Exception:
+                        self._restore(items[i:])
+                        raise
+        finally:
+            self._local.depth = depth
+            if depth == 0 and self._exit is not None and \
+                    threading.current_thread() is threading.main_thread():
+                terminate, self._exit = self._exit, None
+                terminate()
+
+    def _restore(self, items: list):
+        """ Put back changes that could not be written, unless they were
+        superseded in the meantime
+        """
+        with self._cond:
+            for cls, changes in items:
+                self._dirty[cls] = dict(changes, **self._dirty.get(cls, {}))